@@ -5,7 +5,8 @@ import sys
 from discord.ext.commands import when_mentioned_or
 from dotenv import load_dotenv
 
-from nameless import Nameless
+from nameless import Nameless, NamelessSharded
+from nameless.config import nameless_config
 
 load_dotenv()
 
@@ -17,8 +18,25 @@ logging.basicConfig(
     level=logging.DEBUG if is_debug else logging.INFO,
 )
 
-logging.getLogger().name = "nameless"
-
-nameless = Nameless(prefix=when_mentioned_or("nl."))
+# Set by launcher.py, for each worker it starts.
+worker_id: str | None = os.getenv("NAMELESS_WORKER_ID")
+shard_ids: str | None = os.getenv("NAMELESS_SHARD_IDS")
+
+logging.getLogger().name = "nameless" if worker_id is None else f"nameless#{worker_id}"
+
+if shard_ids is None and not nameless_config["nameless"]["sharding"]["enabled"]:
+    nameless = Nameless(prefix=when_mentioned_or("nl."))
+else:
+    shard_count = int(
+        os.getenv("NAMELESS_SHARD_COUNT", nameless_config["nameless"]["sharding"]["shard_count"])
+    )
+
+    nameless = NamelessSharded(
+        prefix=when_mentioned_or("nl."),
+        worker_id=int(worker_id) if worker_id is not None else None,
+        worker_count=int(os.getenv("NAMELESS_WORKERS", 1)),
+        shard_count=shard_count or None,
+        shard_ids=[int(x) for x in shard_ids.split(",")] if shard_ids else None,
+    )
 
 nameless.start_bot(is_debug=is_debug)
@@ -0,0 +1,164 @@
+import json
+import logging
+import math
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+from dotenv import load_dotenv
+from tomllib import loads
+
+# Kept off the `nameless` package, so the launcher does not load discord.py and prisma itself.
+_root: Path = Path(__file__).parent.absolute()
+_config = loads((_root / "nameless.toml").read_text(encoding="utf-8"))
+
+# Seconds before a crashed worker is started again.
+_restart_delay = 5.0
+# Each bucket of `max_concurrency` shards may identify once in this many seconds.
+_identify_interval = 5.0
+
+
+class Worker:
+    """A bootstrapper process owning a range of the shards."""
+
+    def __init__(self, worker_id: int, shard_ids: list[int], env: dict[str, str]) -> None:
+        self.worker_id: int = worker_id
+        self.shard_ids: list[int] = shard_ids
+        self.env: dict[str, str] = env
+        self.process: subprocess.Popen[bytes] | None = None
+        self.restart_at: float | None = None
+
+    def start(self):
+        logging.info("Starting worker %d with shard(s) %s.", self.worker_id, self.shard_ids)
+
+        self.restart_at = None
+        self.process = subprocess.Popen(
+            [sys.executable, str(_root / "bootstrapper.py")],
+            cwd=_root,
+            env={
+                **self.env,
+                "NAMELESS_WORKER_ID": str(self.worker_id),
+                "NAMELESS_SHARD_IDS": ",".join(map(str, self.shard_ids)),
+            },
+            # Signals reach workers only through the launcher, so one Ctrl-C drains each once.
+            start_new_session=True,
+        )
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.send_signal(signal.SIGINT)
+
+
+def get_gateway() -> tuple[int, int]:
+    """Ask Discord for the recommended shard count, and how many shards may identify at once."""
+    request = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={
+            "Authorization": f"Bot {os.getenv('TOKEN', '')}",
+            "User-Agent": "DiscordBot (https://github.com/team-nameless/nameless-discord-bot)",
+        },
+    )
+
+    with urllib.request.urlopen(request, timeout=30) as response:
+        data = json.load(response)
+
+    return data["shards"], data["session_start_limit"]["max_concurrency"]
+
+
+def split_shards(shard_count: int, workers: int) -> list[list[int]]:
+    """Split the shards into contiguous ranges, as even as possible."""
+    workers = max(min(workers, shard_count), 1)
+
+    return [
+        list(range(shard_count * i // workers, shard_count * (i + 1) // workers))
+        for i in range(workers)
+    ]
+
+
+def main():
+    load_dotenv()
+
+    logging.basicConfig(
+        format="%(asctime)s - [%(levelname)s] [%(name)s] %(message)s",
+        stream=sys.stdout,
+        level=logging.INFO,
+    )
+
+    logging.getLogger().name = "nameless-launcher"
+
+    sharding = _config["nameless"]["sharding"]
+    shard_count = int(os.getenv("NAMELESS_SHARD_COUNT", sharding["shard_count"]))
+    worker_count = int(os.getenv("NAMELESS_WORKERS", sharding["workers"]))
+    max_concurrency = 1
+
+    if shard_count <= 0:
+        shard_count, max_concurrency = get_gateway()
+        logging.info("Discord recommends %d shard(s).", shard_count)
+
+    shard_ranges = split_shards(shard_count, worker_count)
+    # Workers hand crossover relays to each other over Unix sockets in here.
+    bus_dir = tempfile.mkdtemp(prefix="nameless-")
+    env = {
+        **os.environ,
+        "NAMELESS_SHARD_COUNT": str(shard_count),
+        "NAMELESS_WORKERS": str(len(shard_ranges)),
+        "NAMELESS_BUS_DIR": bus_dir,
+    }
+
+    workers = [
+        Worker(worker_id, shard_ids, env) for worker_id, shard_ids in enumerate(shard_ranges)
+    ]
+    stopping = False
+
+    def stop(signum: int, frame: object):
+        nonlocal stopping
+        stopping = True
+
+        logging.warning("Stopping %d worker(s)...", len(workers))
+
+        for worker in workers:
+            worker.stop()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    # Workers are started in turn, so their shards do not identify over each other.
+    for worker in workers:
+        if stopping:
+            break
+
+        worker.start()
+        time.sleep(_identify_interval * math.ceil(len(worker.shard_ids) / max_concurrency))
+
+    running = [worker for worker in workers if worker.process is not None]
+
+    while running:
+        time.sleep(1)
+
+        for worker in tuple(running):
+            assert worker.process is not None
+            code = worker.process.poll()
+
+            if code is None:
+                continue
+
+            if code == 0 or stopping:
+                logging.info("Worker %d exited with %d.", worker.worker_id, code)
+                running.remove(worker)
+            elif worker.restart_at is None:
+                logging.error("Worker %d crashed with %d, restarting it.", worker.worker_id, code)
+                worker.restart_at = time.monotonic() + _restart_delay
+            elif time.monotonic() >= worker.restart_at:
+                worker.start()
+
+    shutil.rmtree(bus_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,195 +1,1029 @@
+import asyncio
 import contextlib
+import datetime
+import functools
+import io
+import json
 import logging
+import time
+from collections import OrderedDict
+from collections.abc import Collection, Iterable, Mapping
+from typing import Any
 
 import discord
 import discord.ui
 from discord.ext import commands
-from prisma.models import CrossChatConnection, CrossChatMessage, CrossChatRoom
+from prisma.models import CrossChatOutbox, CrossChatRoom, CrossChatRoomMember
 
 from nameless import Nameless
+from nameless.config import nameless_config
+from nameless.custom.crossover import CrossOverMessageLink, CrossOverOutboxEntry
 from nameless.custom.crud import NamelessPrisma
 
 __all__ = ["CrossOverCommand"]
 
 nameless_accepted_channels = discord.TextChannel | discord.Thread
 
+# Discord allows this many embeds in one message.
+_max_coalesced_embeds = 10
+_deleted_placeholder = "*This message was deleted.*"
+# Discord deletes at most this many messages in one bulk deletion.
+_max_bulk_delete = 100
+
+
+def _avatar_url(author: Mapping[str, Any]) -> str:
+    """Avatar URL of a raw gateway user, the same one `discord.User.avatar` would give."""
+    avatar: str | None = author.get("avatar")
+
+    if avatar is None:
+        return ""
+
+    extension = "gif" if avatar.startswith("a_") else "png"
+    return f"{discord.Asset.BASE}/avatars/{author['id']}/{avatar}.{extension}?size=1024"
+
+
+class _CoalescedRelay:
+    """Messages of one source channel, waiting to go out to one target as a single post."""
+
+    def __init__(self, member: CrossChatRoomMember) -> None:
+        self.member: CrossChatRoomMember = member
+        self.messages: list[tuple[discord.Message, discord.Embed, CrossOverOutboxEntry]] = []
+        self.timer: asyncio.TimerHandle | None = None
+        self.submitted: bool = False
+
+
+class _SharedDownload:
+    """Attachments of a message from another worker or an earlier run, shared by its relays."""
+
+    def __init__(self, task: asyncio.Task[list[bytes | None]]) -> None:
+        self.task: asyncio.Task[list[bytes | None]] = task
+        self.relays: int = 0
+        self.pending: int = 0
+
 
 class CrossOverCommand(commands.Cog):
     def __init__(self, bot: Nameless):
         self.bot: Nameless = bot
 
-    async def _get_subscribed_channels(
-        self, this_guild: discord.Guild, this_channel: nameless_accepted_channels
-    ) -> list[tuple[CrossChatConnection, nameless_accepted_channels]]:
-        """Get list of subscribed guild channels."""
-        connections = await CrossChatConnection.prisma().find_many(
-            where={"SourceGuildId": this_guild.id, "SourceChannelId": this_channel.id}
-        )
+        self._coalesce_window: float = nameless_config["crossover"]["coalesce_window"]
+        self._open_batches: dict[tuple[int, int], _CoalescedRelay] = {}
+        self._last_relayed: dict[tuple[int, int], float] = {}
 
-        result: list[tuple[CrossChatConnection, nameless_accepted_channels]] = []
+        self._edit_debounce: float = nameless_config["crossover"]["edit_debounce"]
+        self._pending_edits: dict[int, discord.RawMessageUpdateEvent] = {}
+        self._edit_tasks: dict[int, asyncio.Task[None]] = {}
 
-        for conn in connections:
-            guild = self.bot.get_guild(conn.TargetGuildId)
+        # Last edit timestamp relayed per origin, to tell edits from unfurls on uncached messages.
+        self._edited_at_size: int = nameless_config["crossover"]["mapping_cache_size"]
+        self._edited_at: OrderedDict[int, str] = OrderedDict()
+        # Latest embed per origin, None once deleted, read by relays right before they go out.
+        self._revised: OrderedDict[int, discord.Embed | None] = OrderedDict()
 
-            if guild is None:
-                continue
+        self._hand_overs: set[asyncio.Task[None]] = set()
+        self._downloads: dict[int, _SharedDownload] = {}
+
+        self.bot.crossover_outbox.replayer = self._replay_outbox
+        self.bot.crossover_bus.handler = self._receive
+
+    async def cog_unload(self):
+        self.bot.crossover_outbox.replayer = None
+        self.bot.crossover_bus.handler = None
 
-            channel = guild.get_channel(conn.TargetChannelId)
+        # Hand over what is still gathering, rather than leaving it behind.
+        for key in [*self._open_batches]:
+            self._close_batch(key)
 
-            if channel is None:
+        for task in self._edit_tasks.values():
+            task.cancel()
+
+        self._edit_tasks.clear()
+        await asyncio.gather(*[self._send_edit(x) for x in [*self._pending_edits]])
+
+    async def _get_subscribed_messages(
+        self, message_id: int, fresh: bool = False
+    ) -> list[tuple[CrossOverMessageLink, discord.PartialMessage]]:
+        """Get handles to the relayed copies of a message, without fetching them."""
+        result: list[tuple[CrossOverMessageLink, discord.PartialMessage]] = []
+
+        for link in await self.bot.crossover_messages.lookup(message_id, fresh):
+            channel = await self.bot.crossover_resolver.channel(
+                link.TargetGuildId, link.TargetChannelId
+            )
+
+            if not isinstance(channel, nameless_accepted_channels):
                 continue
 
-            if isinstance(channel, nameless_accepted_channels):
-                result.append((conn, channel))
+            result.append((link, channel.get_partial_message(link.ClonedMessageId)))
 
         return result
 
-    async def _get_subscribed_messages(
-        self,
-        this_guild: discord.Guild,
-        this_channel: nameless_accepted_channels,
-        this_message: discord.Message,
-    ) -> list[tuple[CrossChatConnection, discord.Message]]:
-        """Get subscribed messages."""
-        connections = await CrossChatConnection.prisma().find_many(
-            where={
-                "SourceGuildId": this_guild.id,
-                "SourceChannelId": this_channel.id,
-                "Messages": {"some": {"OriginMessageId": this_message.id}},
-            },
-            include={"Messages": True},
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        assert message.guild is not None
+        assert message.channel is not None
+        assert self.bot.user is not None
+
+        if message.author.id == self.bot.user.id:
+            return
+
+        if not isinstance(message.channel, nameless_accepted_channels):
+            return
+
+        if not self.bot.crossover_routes.is_bridged(message.guild.id, message.channel.id):
+            return
+
+        avatar_url = message.author.avatar.url if message.author.avatar else ""
+        embed = self._render_embed(
+            message.content, message.author.global_name, avatar_url, message.channel
         )
 
-        result: list[tuple[CrossChatConnection, discord.Message]] = []
+        members = self.bot.crossover_routes.get(message.guild.id, message.channel.id)
 
-        for conn in connections:
-            guild = self.bot.get_guild(conn.TargetGuildId)
+        if not members:
+            return
 
-            if guild is None:
-                continue
+        # Targets in guilds of other workers are relayed by those, to keep each channel paced
+        # by a single process.
+        remote = {
+            member.Id: worker_id
+            for member in members
+            if (worker_id := self.bot.crossover_bus.owner(member.GuildId)) is not None
+        }
+        local_count = len(members) - len(remote)
+
+        # A new message has no copies yet. Those in guilds of other workers are edited and
+        # deleted by those, so edits and deletes of it here need no query.
+        self.bot.crossover_messages.track(message.id)
+
+        # Started before any relay gets queued, so every target shares one download
+        # and the queues still receive jobs in the order the messages came in.
+        attachments = asyncio.create_task(
+            self._download_attachments(message.attachments if local_count else [], local_count)
+        )
 
-            channel = guild.get_channel(conn.TargetChannelId)
+        coalescable = not message.attachments and not message.stickers
+
+        # Enough to send the copies again after a restart, once the message is long gone.
+        payload = json.dumps(
+            {
+                "embed": embed.to_dict(),
+                "attachments": [
+                    {
+                        "url": x.url,
+                        "filename": x.filename,
+                        "description": x.description,
+                        "spoiler": x.is_spoiler(),
+                    }
+                    for x in message.attachments
+                ],
+                "stickers": [x.id for x in message.stickers],
+            }
+        )
 
-            if channel is None:
+        for member in members:
+            key = (member.ChannelId, message.channel.id)
+            entry = self.bot.crossover_outbox.add("relay", message.id, payload, member.Id)
+
+            # Coalescing needs the origin message at hand, so a relay handed over to another
+            # worker always goes out as a post of its own.
+            if member.Id in remote:
+                hand_over = asyncio.create_task(
+                    self._hand_over(remote[member.Id], member, message.id, payload, entry)
+                )
+                self._hand_overs.add(hand_over)
+                hand_over.add_done_callback(self._hand_overs.discard)
                 continue
 
-            if not isinstance(channel, nameless_accepted_channels):
+            if (
+                member.Coalesce
+                and coalescable
+                and self._coalesce(key, member, message, embed, entry)
+            ):
                 continue
 
-            assert conn.Messages is not None
+            # Anything still gathering for this target goes first, to keep the order.
+            self._close_batch(key)
+
+            self.bot.crossover_scheduler.submit(
+                member.ChannelId,
+                functools.partial(self._relay, message, embed, attachments, member, entry),
+            )
+
+    async def _hand_over(
+        self,
+        worker_id: int,
+        member: CrossChatRoomMember,
+        origin_id: int,
+        payload: str,
+        entry: CrossOverOutboxEntry,
+    ):
+        """Relay a message through the worker owning the target, once it is in the outbox."""
+        await entry.written.wait()
+        await self._relay_through(worker_id, member, origin_id, payload)
+        self.bot.crossover_outbox.complete(entry)
 
-            the_true_id: int = [
-                x.ClonedMessageId for x in conn.Messages if x.OriginMessageId == this_message.id
-            ][0]
+    async def _relay_through(
+        self, worker_id: int, member: CrossChatRoomMember, origin_id: int, payload: str
+    ):
+        """Relay a message through the worker owning the target, or from here if it can not."""
+        job = {
+            "kind": "relay",
+            "member": member.Id,
+            "room": member.RoomId,
+            "guild": member.GuildId,
+            "channel": member.ChannelId,
+            "origin": origin_id,
+            "payload": payload,
+        }
+
+        if await self.bot.crossover_bus.send(worker_id, job):
+            self.bot.crossover_metrics.relays_handed_over += 1
+        else:
+            self.bot.crossover_metrics.hand_over_fallbacks += 1
+            await self._submit_replay(member, origin_id, json.loads(payload))
+
+    async def _receive(self, job: dict[str, Any]) -> asyncio.Future[None] | None:
+        """Take crossover work handed over by another worker."""
+        if job["kind"] == "edit":
+            embed = discord.Embed.from_dict(job["embed"])
+            self._revise(job["origin"], embed)
+
+            return asyncio.create_task(self._update_copies(job["origin"], embed))
+
+        if job["kind"] == "delete":
+            for origin_id in job["origins"]:
+                self._withdraw(origin_id)
+
+            return asyncio.create_task(self._delete_all_copies(job["origins"]))
+
+        member = None
+
+        if job["kind"] == "relay":
+            member = self.bot.crossover_routes.find(job["room"], job["guild"], job["channel"])
+
+        # Joined or changed through another worker since the routes were loaded here.
+        if member is None:
+            member = await CrossChatRoomMember.prisma().find_unique(where={"Id": job["member"]})
+
+            if member is None:
+                return None
+
+            self.bot.crossover_routes.add(member)
+
+        if job["kind"] != "relay":
+            return None
+
+        return self._submit_replay(member, job["origin"], json.loads(job["payload"]))
+
+    async def _hand_over_update(
+        self, guild_id: int, channel_id: int, job: dict[str, Any]
+    ) -> set[int]:
+        """
+        Hand an edit or delete to the workers owning targets of a channel.
+
+        Return the workers it could not be handed to, whose copies are then
+        left to this one.
+        """
+        workers = {
+            worker_id
+            for member in self.bot.crossover_routes.get(guild_id, channel_id)
+            if (worker_id := self.bot.crossover_bus.owner(member.GuildId)) is not None
+        }
+        ran = await asyncio.gather(*[self.bot.crossover_bus.send(x, job) for x in workers])
+
+        return {worker_id for worker_id, done in zip(workers, ran, strict=True) if not done}
+
+    def _owns(self, link: CrossOverMessageLink, others: Collection[int] = ()) -> bool:
+        """Whether a copy is updated by this worker, standing in for `others` as well."""
+        owner = self.bot.crossover_bus.owner(link.TargetGuildId)
+
+        return owner is None or owner in others
+
+    def _share_routes(self, members: list[CrossChatRoomMember]):
+        """Let the other workers know of members added or changed here."""
+        for member in members:
+            self.bot.crossover_bus.broadcast({"kind": "route", "member": member.Id})
+
+    def _coalesce(
+        self,
+        key: tuple[int, int],
+        member: CrossChatRoomMember,
+        message: discord.Message,
+        embed: discord.Embed,
+        entry: CrossOverOutboxEntry,
+    ) -> bool:
+        """
+        Try to relay a message as part of a coalesced post.
+
+        A post gathers messages while it waits in a backed up queue, or for a
+        short window once a burst is noticed. Return False if this message
+        should rather go out on its own.
+        """
+        batch = self._open_batches.get(key)
+
+        if batch is not None and len(batch.messages) < _max_coalesced_embeds:
+            batch.messages.append((message, embed, entry))
+            return True
+
+        self._close_batch(key)
+
+        now = time.monotonic()
+        backed_up = self.bot.crossover_scheduler.depth(member.ChannelId) > 0
+        bursting = now - self._last_relayed.get(key, 0.0) < self._coalesce_window
+        self._last_relayed[key] = now
+
+        if not backed_up and not bursting:
+            return False
+
+        batch = _CoalescedRelay(member)
+        batch.messages.append((message, embed, entry))
+        self._open_batches[key] = batch
+
+        if backed_up:
+            self._submit_batch(key, batch)
+        else:
+            batch.timer = asyncio.get_running_loop().call_later(
+                self._coalesce_window, self._submit_batch, key, batch
+            )
+
+        return True
 
-            the_true_message = await channel.fetch_message(the_true_id)
+    def _submit_batch(self, key: tuple[int, int], batch: _CoalescedRelay):
+        """Queue a coalesced post. It keeps gathering messages until it starts sending."""
+        if batch.submitted:
+            return
 
-            result.append((conn, the_true_message))
+        if batch.timer is not None:
+            batch.timer.cancel()
 
-        return result
+        batch.submitted = True
+        self.bot.crossover_scheduler.submit(
+            batch.member.ChannelId, functools.partial(self._relay_batch, key, batch)
+        )
+
+    def _close_batch(self, key: tuple[int, int]):
+        """Stop a coalesced post from gathering more messages, and queue it."""
+        batch = self._open_batches.pop(key, None)
+
+        if batch is not None:
+            self._submit_batch(key, batch)
 
-    async def _is_connected_to_each_other(
+    def _render_embed(
         self,
-        this_guild: discord.Guild,
-        this_channel: nameless_accepted_channels,
-        that_guild: discord.Guild,
-        that_channel: nameless_accepted_channels,
-    ) -> bool:
-        """Return if the 2 rooms are connected."""
-        conn1 = await CrossChatConnection.prisma().find_first(
-            where={
-                "SourceGuildId": this_guild.id,
-                "SourceChannelId": this_channel.id,
-                "TargetGuildId": that_guild.id,
-                "TargetChannelId": that_channel.id,
-            }
+        content: str,
+        author_name: str | None,
+        avatar_url: str,
+        channel: discord.TextChannel | discord.Thread,
+    ) -> discord.Embed:
+        """Render the embed that relays a message."""
+        embed = discord.Embed(description=content, color=discord.Colour.orange())
+
+        guild_icon = channel.guild.icon.url if channel.guild.icon else ""
+
+        embed.set_author(name=f"@{author_name} wrote:", icon_url=avatar_url)
+        embed.set_footer(text=f"{channel.guild.name} at #{channel.name}", icon_url=guild_icon)
+
+        return embed
+
+    async def _download_attachments(
+        self, attachments: list[discord.Attachment], target_count: int
+    ) -> list[tuple[discord.Attachment, bytes]]:
+        """Download attachments of a message once, to be shared across all its relays."""
+        if not attachments:
+            return []
+
+        contents = await asyncio.gather(*[x.read() for x in attachments])
+        downloaded = sum(len(x) for x in contents)
+
+        self.bot.crossover_metrics.attachment_bytes_downloaded += downloaded
+        self.bot.crossover_metrics.attachment_bytes_saved += downloaded * (target_count - 1)
+
+        return list(zip(attachments, contents, strict=True))
+
+    async def _relay(
+        self,
+        message: discord.Message,
+        embed: discord.Embed,
+        attachments: asyncio.Task[list[tuple[discord.Attachment, bytes]]],
+        member: CrossChatRoomMember,
+        entry: CrossOverOutboxEntry,
+    ):
+        """Send a copy of the message to one subscribed channel."""
+        # Resolved here rather than upfront, so uncached threads can be fetched
+        # without holding up the other targets, or breaking the queue order.
+        channel = await self.bot.crossover_resolver.channel(member.GuildId, member.ChannelId)
+
+        if not isinstance(channel, nameless_accepted_channels):
+            self.bot.crossover_outbox.complete(entry)
+            return
+
+        # Each send consumes its own file handles, but they all read the same bytes.
+        files = [
+            discord.File(
+                io.BytesIO(content),
+                filename=attachment.filename,
+                description=attachment.description,
+                spoiler=attachment.is_spoiler(),
+            )
+            for attachment, content in await attachments
+        ]
+
+        await entry.written.wait()
+        revised = self._revised.get(message.id, embed)
+
+        if revised is None:
+            self.bot.crossover_outbox.complete(entry)
+            return
+
+        with self._give_up_if_refused([entry]):
+            sent_message = await channel.send(embed=revised, stickers=message.stickers, files=files)
+
+        link = self.bot.crossover_messages.record(member, message.id, sent_message.id)
+        await self._catch_up(channel, link, message.id, revised)
+        self.bot.crossover_outbox.complete(entry)
+
+    async def _relay_batch(self, key: tuple[int, int], batch: _CoalescedRelay):
+        """Send a coalesced post to its subscribed channel."""
+        if self._open_batches.get(key) is batch:
+            del self._open_batches[key]
+
+        channel = await self.bot.crossover_resolver.channel(
+            batch.member.GuildId, batch.member.ChannelId
         )
 
-        conn2 = await CrossChatConnection.prisma().find_first(
-            where={
-                "SourceGuildId": that_guild.id,
-                "SourceChannelId": that_channel.id,
-                "TargetGuildId": this_guild.id,
-                "TargetChannelId": this_channel.id,
-            }
+        if not isinstance(channel, nameless_accepted_channels):
+            for _, _, entry in batch.messages:
+                self.bot.crossover_outbox.complete(entry)
+
+            return
+
+        for _, _, entry in batch.messages:
+            await entry.written.wait()
+
+        messages: list[tuple[discord.Message, discord.Embed, CrossOverOutboxEntry]] = []
+
+        for message, embed, entry in batch.messages:
+            revised = self._revised.get(message.id, embed)
+
+            if revised is None:
+                self.bot.crossover_outbox.complete(entry)
+            else:
+                messages.append((message, revised, entry))
+
+        if not messages:
+            return
+
+        embeds = [embed for _, embed, _ in messages]
+
+        with self._give_up_if_refused([entry for _, _, entry in messages]):
+            if len(embeds) == 1:
+                sent_message = await channel.send(embed=embeds[0])
+            else:
+                sent_message = await channel.send(embeds=embeds)
+
+        if len(embeds) == 1:
+            origin, embed, entry = messages[0]
+
+            link = self.bot.crossover_messages.record(batch.member, origin.id, sent_message.id)
+            await self._catch_up(channel, link, origin.id, embed)
+            self.bot.crossover_outbox.complete(entry)
+            return
+
+        self.bot.crossover_messages.remember_post(sent_message.id, embeds)
+
+        links = [
+            self.bot.crossover_messages.record(batch.member, message.id, sent_message.id, index)
+            for index, (message, _, _) in enumerate(messages)
+        ]
+
+        for link, (message, embed, entry) in zip(links, messages, strict=True):
+            await self._catch_up(channel, link, message.id, embed)
+            self.bot.crossover_outbox.complete(entry)
+
+    @contextlib.contextmanager
+    def _give_up_if_refused(self, entries: list[CrossOverOutboxEntry]):
+        """Complete the outbox entries of a send Discord refuses for good, then re-raise."""
+        try:
+            yield
+        except discord.HTTPException as ex:
+            # Gone, out of reach or invalid: a replay on the next run would get the same answer.
+            if ex.status < 500:
+                for entry in entries:
+                    self.bot.crossover_outbox.complete(entry)
+
+            raise
+
+    async def _catch_up(
+        self,
+        channel: discord.TextChannel | discord.Thread,
+        link: CrossOverMessageLink,
+        origin_id: int,
+        embed: discord.Embed,
+    ):
+        """
+        Apply an edit or delete that came in while a copy was being sent, too late to see it.
+
+        Runs inside the job that sent the copy, so it never raises: a retry of
+        that job would send the copy again.
+        """
+        try:
+            await self._update_sent_copy(channel, link, origin_id, embed)
+        except discord.RateLimited:
+            # Only the update goes back in the queue, which holds the channel back meanwhile.
+            self.bot.crossover_scheduler.submit(
+                link.TargetChannelId,
+                functools.partial(self._update_sent_copy, channel, link, origin_id, embed),
+            )
+        except discord.HTTPException:
+            logging.exception("Failed to update a copy sent in channel %s.", link.TargetChannelId)
+
+    async def _update_sent_copy(
+        self,
+        channel: discord.TextChannel | discord.Thread,
+        link: CrossOverMessageLink,
+        origin_id: int,
+        embed: discord.Embed,
+    ):
+        """Bring a copy sent with `embed` up to the latest one of its origin, if that changed."""
+        revised = self._revised.get(origin_id, embed)
+
+        if revised is embed:
+            return
+
+        with contextlib.suppress(discord.NotFound):
+            await self._update_post(
+                link, channel.get_partial_message(link.ClonedMessageId), revised
+            )
+
+    def _revise(self, message_id: int, embed: discord.Embed | None):
+        """Keep the latest embed of a message, or None once deleted, for relays not sent yet."""
+        self._revised[message_id] = embed
+        self._revised.move_to_end(message_id)
+
+        if len(self._revised) > self._edited_at_size:
+            self._revised.popitem(last=False)
+
+    def _withdraw(self, message_id: int):
+        """Keep a deleted message from going out, while gathering in a post or queued."""
+        self._revise(message_id, None)
+
+        for key, batch in [*self._open_batches.items()]:
+            for item in [x for x in batch.messages if x[0].id == message_id]:
+                batch.messages.remove(item)
+                self.bot.crossover_outbox.complete(item[2])
+
+            if not batch.messages and not batch.submitted:
+                if batch.timer is not None:
+                    batch.timer.cancel()
+
+                del self._open_batches[key]
+
+    async def _update_post(
+        self,
+        link: CrossOverMessageLink,
+        the_message: discord.PartialMessage,
+        embed: discord.Embed | None,
+    ):
+        """
+        Replace (or, with no embed, delete) one relayed message.
+
+        Inside a coalesced post only its own embed is touched, and the post
+        itself goes away once every embed of it was deleted.
+        """
+        if link.EmbedIndex is None:
+            if embed is None:
+                await the_message.delete()
+            else:
+                await the_message.edit(embed=embed)
+
+            return
+
+        embeds = self.bot.crossover_messages.get_post(link.ClonedMessageId)
+
+        if embeds is None:
+            # Fell out of the cache, reading it back is the only way left.
+            embeds = (await the_message.fetch()).embeds
+
+        embeds = [*embeds]
+        embeds[link.EmbedIndex] = embed or discord.Embed(
+            description=_deleted_placeholder, color=discord.Colour.orange()
         )
 
-        return not (conn1 is None and conn2 is None)
+        if all(x.description == _deleted_placeholder for x in embeds):
+            await the_message.delete()
+            return
+
+        self.bot.crossover_messages.remember_post(link.ClonedMessageId, embeds)
+        await the_message.edit(embeds=embeds)
 
     @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        assert message.guild is not None
-        assert message.channel is not None
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
         assert self.bot.user is not None
 
-        if message.author.id == self.bot.user.id:
+        if payload.guild_id is None:
             return
 
-        if not isinstance(message.channel, nameless_accepted_channels):
+        if not self.bot.crossover_routes.is_bridged(payload.guild_id, payload.channel_id):
             return
 
-        for conn, channel in await self._get_subscribed_channels(message.guild, message.channel):
-            embed = discord.Embed(description=message.content, color=discord.Colour.orange())
+        author = payload.data.get("author")
 
-            avatar_url = message.author.avatar.url if message.author.avatar else ""
-            guild_icon = message.guild.icon.url if message.guild.icon else ""
+        if author is None or int(author["id"]) == self.bot.user.id:
+            return
 
-            embed.set_author(name=f"@{message.author.global_name} wrote:", icon_url=avatar_url)
-            embed.set_footer(
-                text=f"{message.guild.name} at #{message.channel.name}", icon_url=guild_icon
+        # Link unfurls, pins and such also come as edits, with nothing to relay.
+        # Only a content edit moves the edit timestamp.
+        edited_at = payload.data.get("edited_timestamp")
+
+        if (
+            "content" not in payload.data
+            or edited_at is None
+            or self._edited_at.get(payload.message_id) == edited_at
+            or (
+                payload.cached_message is not None
+                and payload.cached_message.content == payload.data["content"]
             )
+        ):
+            self.bot.crossover_metrics.edits_skipped += 1
+            return
 
-            sent_message = await channel.send(
-                embed=embed,
-                stickers=message.stickers,
-                files=[await x.to_file() for x in message.attachments],
+        self._edited_at[payload.message_id] = edited_at
+        self._edited_at.move_to_end(payload.message_id)
+
+        if len(self._edited_at) > self._edited_at_size:
+            self._edited_at.popitem(last=False)
+
+        if payload.message_id in self._pending_edits:
+            self.bot.crossover_metrics.edits_collapsed += 1
+        else:
+            self._edit_tasks[payload.message_id] = asyncio.create_task(
+                self._propagate_edit(payload.message_id)
             )
 
-            await CrossChatMessage.prisma().create(
-                data={
-                    "Connection": {"connect": {"Id": conn.Id}},
-                    "OriginMessageId": message.id,
-                    "ClonedMessageId": sent_message.id,
+        self._pending_edits[payload.message_id] = payload
+
+    async def _propagate_edit(self, message_id: int):
+        """Relay the last edit of a message, once the debounce window is over."""
+        await asyncio.sleep(self._edit_debounce)
+
+        del self._edit_tasks[message_id]
+        await self._send_edit(message_id)
+
+    async def _send_edit(self, message_id: int):
+        """Relay the last edit of a message right away."""
+        payload = self._pending_edits.pop(message_id)
+
+        assert payload.guild_id is not None
+
+        channel = await self.bot.crossover_resolver.channel(payload.guild_id, payload.channel_id)
+
+        if not isinstance(channel, nameless_accepted_channels):
+            return
+
+        # The copies are rendered from the source message alone,
+        # so they can be rebuilt from the gateway data instead of being read back.
+        author = payload.data["author"]
+        embed = self._render_embed(
+            payload.data["content"], author.get("global_name"), _avatar_url(author), channel
+        )
+        self._revise(message_id, embed)
+
+        entry = self.bot.crossover_outbox.add(
+            "edit",
+            message_id,
+            json.dumps(
+                {
+                    "embed": embed.to_dict(),
+                    "guild": payload.guild_id,
+                    "channel": payload.channel_id,
                 }
-            )
+            ),
+        )
+        await entry.written.wait()
+
+        others = await self._hand_over_update(
+            payload.guild_id,
+            payload.channel_id,
+            {"kind": "edit", "origin": message_id, "embed": embed.to_dict()},
+        )
+        await self._update_copies(message_id, embed, others)
+        self.bot.crossover_outbox.complete(entry)
 
     @commands.Cog.listener()
-    async def on_message_edit(self, _: discord.Message, message: discord.Message):
-        assert message.guild is not None
-        assert message.channel is not None
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
         assert self.bot.user is not None
 
-        if message.author.id == self.bot.user.id:
+        if payload.guild_id is None:
             return
 
-        if not isinstance(message.channel, nameless_accepted_channels):
+        if not self.bot.crossover_routes.is_bridged(payload.guild_id, payload.channel_id):
             return
 
-        for _conn, the_message in await self._get_subscribed_messages(
-            message.guild, message.channel, message
+        if (
+            payload.cached_message is not None
+            and payload.cached_message.author.id == self.bot.user.id
         ):
-            the_embed = the_message.embeds[0]
-            the_embed.description = message.content
+            return
+
+        self._forget_edits(payload.message_id)
+        self._withdraw(payload.message_id)
 
-            await the_message.edit(embed=the_embed)
+        entry = self.bot.crossover_outbox.add(
+            "delete",
+            payload.message_id,
+            json.dumps({"guild": payload.guild_id, "channel": payload.channel_id}),
+        )
+        await entry.written.wait()
+
+        others = await self._hand_over_update(
+            payload.guild_id,
+            payload.channel_id,
+            {"kind": "delete", "origins": [payload.message_id]},
+        )
+        await self._update_copies(payload.message_id, None, others)
+        self.bot.crossover_outbox.complete(entry)
+
+    async def _update_copies(
+        self, message_id: int, embed: discord.Embed | None, others: Collection[int] = ()
+    ):
+        """
+        Replace (or, with no embed, delete) the relayed copies of a message.
+
+        Only copies in guilds of this worker are touched, and those of the
+        workers in `others`.
+        """
+        # Copies of the workers stood in for were never recorded here, only the database has them.
+        for link, the_message in await self._get_subscribed_messages(message_id, bool(others)):
+            if not self._owns(link, others):
+                continue
+
+            with contextlib.suppress(discord.NotFound):
+                await self._update_post(link, the_message, embed)
 
     @commands.Cog.listener()
-    async def on_message_delete(self, message: discord.Message):
-        assert message.guild is not None
-        assert message.channel is not None
-        assert self.bot.user is not None
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        if payload.guild_id is None:
+            return
 
-        if message.author.id == self.bot.user.id:
+        if not self.bot.crossover_routes.is_bridged(payload.guild_id, payload.channel_id):
             return
 
-        if not isinstance(message.channel, nameless_accepted_channels):
+        where = json.dumps({"guild": payload.guild_id, "channel": payload.channel_id})
+        entries = [
+            self.bot.crossover_outbox.add("delete", message_id, where)
+            for message_id in payload.message_ids
+        ]
+
+        for message_id in payload.message_ids:
+            self._forget_edits(message_id)
+            self._withdraw(message_id)
+
+        for entry in entries:
+            await entry.written.wait()
+
+        others = await self._hand_over_update(
+            payload.guild_id,
+            payload.channel_id,
+            {"kind": "delete", "origins": [*payload.message_ids]},
+        )
+        await self._delete_all_copies(payload.message_ids, others)
+
+        for entry in entries:
+            self.bot.crossover_outbox.complete(entry)
+
+    async def _delete_all_copies(self, message_ids: Iterable[int], others: Collection[int] = ()):
+        """
+        Delete the relayed copies of several messages at once.
+
+        Only copies in guilds of this worker are touched, and those of the
+        workers in `others`.
+        """
+        # Plain copies are grouped per channel for bulk deletion,
+        # parts of coalesced posts still have to be edited one by one.
+        plain: dict[tuple[int, int], list[int]] = {}
+        coalesced: list[CrossOverMessageLink] = []
+
+        found = await self.bot.crossover_messages.lookup_many(message_ids, bool(others))
+
+        for links in found.values():
+            for link in links:
+                if not self._owns(link, others):
+                    continue
+
+                if link.EmbedIndex is None:
+                    target = (link.TargetGuildId, link.TargetChannelId)
+                    plain.setdefault(target, []).append(link.ClonedMessageId)
+                else:
+                    coalesced.append(link)
+
+        await asyncio.gather(
+            *[
+                self._delete_copies(guild_id, channel_id, cloned_ids)
+                for (guild_id, channel_id), cloned_ids in plain.items()
+            ]
+        )
+
+        for link in coalesced:
+            channel = await self.bot.crossover_resolver.channel(
+                link.TargetGuildId, link.TargetChannelId
+            )
+
+            if not isinstance(channel, nameless_accepted_channels):
+                continue
+
+            with contextlib.suppress(discord.NotFound):
+                await self._update_post(
+                    link, channel.get_partial_message(link.ClonedMessageId), None
+                )
+
+    def _forget_edits(self, message_id: int):
+        """Drop edit state of a deleted message, there is no point relaying its edits."""
+        if (pending_edit := self._edit_tasks.pop(message_id, None)) is not None:
+            pending_edit.cancel()
+            del self._pending_edits[message_id]
+
+        self._edited_at.pop(message_id, None)
+
+    async def _delete_copies(self, guild_id: int, channel_id: int, cloned_ids: list[int]):
+        """Delete relayed copies in one channel, with as few requests as Discord allows."""
+        channel = await self.bot.crossover_resolver.channel(guild_id, channel_id)
+
+        if not isinstance(channel, nameless_accepted_channels):
             return
 
-        for _conn, the_message in await self._get_subscribed_messages(
-            message.guild, message.channel, message
-        ):
+        # Bulk deletion refuses messages older than two weeks, kept a minute clear of the edge.
+        oldest_allowed = discord.utils.time_snowflake(
+            discord.utils.utcnow() - datetime.timedelta(days=14) + datetime.timedelta(minutes=1)
+        )
+        recent = [x for x in cloned_ids if x > oldest_allowed]
+        one_by_one = [x for x in cloned_ids if x <= oldest_allowed]
+
+        for index in range(0, len(recent), _max_bulk_delete):
+            chunk = recent[index : index + _max_bulk_delete]
+
+            try:
+                await channel.delete_messages([discord.Object(x) for x in chunk])
+            except discord.Forbidden:
+                # Bulk deletion needs Manage Messages, deleting our own messages does not.
+                one_by_one.extend(recent[index:])
+                break
+            except discord.NotFound:
+                pass
+
+        for cloned_id in one_by_one:
             with contextlib.suppress(discord.NotFound):
-                await the_message.delete()
+                await channel.get_partial_message(cloned_id).delete()
+
+    async def _replay_outbox(self, entries: list[CrossChatOutbox]):
+        """Carry out relays, edits and deletes left over from an earlier run."""
+        # Fresh, as copies in guilds of other workers were recorded by those.
+        links = await self.bot.crossover_messages.lookup_many(
+            {entry.OriginMessageId for entry in entries}, fresh=True
+        )
+        members = {
+            member.Id: member
+            for member in await CrossChatRoomMember.prisma().find_many(
+                where={"Id": {"in": [entry.MemberId for entry in entries if entry.MemberId]}}
+            )
+        }
+        relays: list[asyncio.Future[None]] = []
+
+        for entry in entries:
+            payload = json.loads(entry.Payload)
+
+            if entry.Kind == "relay":
+                member = members.get(entry.MemberId or "")
+
+                # Left the room since, or sent right before the process went down.
+                if member is None or any(
+                    link.MemberId == member.Id for link in links[entry.OriginMessageId]
+                ):
+                    continue
+
+                owner = self.bot.crossover_bus.owner(member.GuildId)
+
+                if owner is None:
+                    relays.append(self._submit_replay(member, entry.OriginMessageId, payload))
+                else:
+                    relays.append(
+                        asyncio.ensure_future(
+                            self._relay_through(owner, member, entry.OriginMessageId, entry.Payload)
+                        )
+                    )
+
+                continue
+
+            # Edits and deletes need the copies before them to be sent first.
+            await asyncio.gather(*relays)
+            relays.clear()
+
+            embed = discord.Embed.from_dict(payload["embed"]) if entry.Kind == "edit" else None
+            job = (
+                {"kind": "edit", "origin": entry.OriginMessageId, "embed": payload["embed"]}
+                if embed is not None
+                else {"kind": "delete", "origins": [entry.OriginMessageId]}
+            )
+            others: set[int] = set()
+
+            # Entries of older runs do not say where the message was, those stay local.
+            if "guild" in payload:
+                others = await self._hand_over_update(payload["guild"], payload["channel"], job)
+
+            await self._update_copies(entry.OriginMessageId, embed, others)
+
+        await asyncio.gather(*relays)
+
+    def _submit_replay(
+        self, member: CrossChatRoomMember, origin_id: int, payload: dict[str, Any]
+    ) -> asyncio.Future[None]:
+        """Queue a relay from its payload, sharing one download with the others of its origin."""
+        download = self._downloads.get(origin_id)
+
+        if download is None:
+            download = _SharedDownload(
+                asyncio.create_task(self._download_urls(payload["attachments"]))
+            )
+            self._downloads[origin_id] = download
+
+        download.relays += 1
+        download.pending += 1
+
+        relay = self.bot.crossover_scheduler.submit(
+            member.ChannelId,
+            functools.partial(self._replay_relay, member, origin_id, payload, download.task),
+        )
+        relay.add_done_callback(lambda _: self._release_download(origin_id, download))
+
+        return relay
+
+    def _release_download(self, origin_id: int, download: _SharedDownload):
+        """Let go of a shared download once the last relay using it is done."""
+        download.pending -= 1
+
+        if download.pending > 0:
+            return
+
+        del self._downloads[origin_id]
+
+        if download.task.done() and not download.task.cancelled():
+            downloaded = sum(len(x) for x in download.task.result() if x is not None)
+            self.bot.crossover_metrics.attachment_bytes_saved += downloaded * (download.relays - 1)
+
+    async def _download_urls(self, attachments: list[dict[str, Any]]) -> list[bytes | None]:
+        """Download attachments by their URLs, with None for those expired since."""
+
+        async def download(url: str) -> bytes | None:
+            # Attachment links expire after a while, those are left out.
+            with contextlib.suppress(discord.HTTPException):
+                return await self.bot.http.get_from_cdn(url)
+
+            return None
+
+        contents = await asyncio.gather(*[download(x["url"]) for x in attachments])
+        self.bot.crossover_metrics.attachment_bytes_downloaded += sum(
+            len(x) for x in contents if x is not None
+        )
+
+        return contents
+
+    async def _replay_relay(
+        self,
+        member: CrossChatRoomMember,
+        origin_id: int,
+        payload: dict[str, Any],
+        attachments: asyncio.Task[list[bytes | None]],
+    ):
+        """Send a copy of a message from its payload, as kept in the outbox, to one channel."""
+        channel = await self.bot.crossover_resolver.channel(member.GuildId, member.ChannelId)
+
+        if not isinstance(channel, nameless_accepted_channels):
+            return
+
+        files = [
+            discord.File(
+                io.BytesIO(content),
+                filename=attachment["filename"],
+                description=attachment["description"],
+                spoiler=attachment["spoiler"],
+            )
+            for attachment, content in zip(payload["attachments"], await attachments, strict=True)
+            if content is not None
+        ]
+
+        # Only stickers still known to the client can be sent again.
+        stickers = [
+            sticker for x in payload["stickers"] if (sticker := self.bot.get_sticker(x)) is not None
+        ]
+
+        embed = self._revised.get(origin_id, discord.Embed.from_dict(payload["embed"]))
+
+        if embed is None:
+            return
+
+        sent_message = await channel.send(embed=embed, stickers=stickers, files=files)
+
+        link = self.bot.crossover_messages.record(member, origin_id, sent_message.id)
+        await self._catch_up(channel, link, origin_id, embed)
 
     @commands.hybrid_group(fallback="code")
     @commands.guild_only()
@@ -216,6 +1050,13 @@ class CrossOverCommand(commands.Cog):
                 data={"GuildId": ctx.guild.id, "ChannelId": ctx.channel.id}
             )
 
+        # The hosting channel is a member of its own room.
+        host_member = await NamelessPrisma.get_room_member_entry(
+            room_data.Id, ctx.guild.id, ctx.channel.id
+        )
+        self.bot.crossover_routes.add(host_member)
+        self._share_routes([host_member])
+
         await ctx.send(f"Your cross-chat room code is: `{room_data.Id}`")
 
     @crossover.command()
@@ -238,58 +1079,45 @@ class CrossOverCommand(commands.Cog):
             return
 
         this_guild = ctx.guild
-        that_guild = await ctx.bot.fetch_guild(room_data.GuildId)
+        that_guild = await ctx.bot.crossover_resolver.guild(room_data.GuildId)
 
         assert this_guild is not None
-        assert that_guild is not None
 
         this_channel = ctx.channel
-        that_channel = await ctx.bot.fetch_channel(room_data.ChannelId)
+        that_channel = await ctx.bot.crossover_resolver.channel(
+            room_data.GuildId, room_data.ChannelId
+        )
 
         assert this_channel is not None
-        assert that_channel is not None
 
         if not isinstance(this_channel, nameless_accepted_channels):
             await ctx.send("You are not inside our accepted channel type (Text/Thread).")
             return
 
-        assert isinstance(this_channel, nameless_accepted_channels)
-        assert isinstance(that_channel, nameless_accepted_channels)
-
-        if await self._is_connected_to_each_other(
-            this_guild, this_channel, that_guild, that_channel
-        ):
-            await ctx.send("Already connected!")
+        if that_guild is None or not isinstance(that_channel, nameless_accepted_channels):
+            await ctx.send("The room's channel is not reachable anymore!")
             return
 
         if room_data.GuildId == this_guild.id and room_data.ChannelId == ctx.channel.id:
             await ctx.send("Don't connect to yourself!")
             return
 
-        await NamelessPrisma.get_guild_entry(this_guild)
-        await NamelessPrisma.get_guild_entry(that_guild)
+        if self.bot.crossover_routes.is_member(room_code, this_guild.id, this_channel.id):
+            await ctx.send("Already connected!")
+            return
+
+        members = await NamelessPrisma.join_room(room_data, this_guild.id, this_channel.id)
 
-        await CrossChatConnection.prisma().create(
-            data={
-                "RoomId": room_code,
-                "SourceGuildId": this_guild.id,
-                "SourceChannelId": this_channel.id,
-                "TargetGuildId": that_guild.id,
-                "TargetChannelId": that_channel.id,
-            }
-        )
+        if members is None:
+            await ctx.send("Already connected!")
+            return
 
-        await this_channel.send("Linking success!")
+        for member in members:
+            self.bot.crossover_routes.add(member)
 
-        await CrossChatConnection.prisma().create(
-            data={
-                "RoomId": room_code,
-                "SourceGuildId": that_guild.id,
-                "SourceChannelId": that_channel.id,
-                "TargetGuildId": this_guild.id,
-                "TargetChannelId": this_channel.id,
-            }
-        )
+        self._share_routes([*members])
+
+        await this_channel.send("Linking success!")
 
         assert isinstance(this_channel.name, str)
 
@@ -299,30 +1127,103 @@ class CrossOverCommand(commands.Cog):
 
     @crossover.command()
     @commands.guild_only()
-    @commands.has_guild_permissions()
-    async def list(self, ctx: commands.Context[Nameless]):
+    @commands.has_guild_permissions(manage_guild=True)
+    async def coalesce(
+        self,
+        ctx: commands.Context[Nameless],
+        enabled: bool = commands.parameter(description="Whether to merge bursts into one post."),
+    ):
+        """Merge bursts of relayed messages into this channel into single posts."""
         await ctx.defer()
 
         assert ctx.guild is not None
         assert ctx.channel is not None
 
-        connections = await CrossChatConnection.prisma().find_many(
-            where={
-                "OR": [
-                    {"SourceGuildId": ctx.guild.id, "SourceChannelId": ctx.channel.id},
-                    {"TargetGuildId": ctx.guild.id, "TargetChannelId": ctx.channel.id},
-                ]
-            },
-            distinct=["RoomId"],
+        if not self.bot.crossover_routes.is_bridged(ctx.guild.id, ctx.channel.id):
+            await ctx.send("This channel is not connected to any room!")
+            return
+
+        await CrossChatRoomMember.prisma().update_many(
+            where={"GuildId": ctx.guild.id, "ChannelId": ctx.channel.id},
+            data={"Coalesce": enabled},
+        )
+
+        members = await CrossChatRoomMember.prisma().find_many(
+            where={"GuildId": ctx.guild.id, "ChannelId": ctx.channel.id}
+        )
+
+        for member in members:
+            self.bot.crossover_routes.add(member)
+
+        self._share_routes(members)
+
+        await ctx.send(f"Burst coalescing is now {'on' if enabled else 'off'} for this channel.")
+
+    @crossover.command()
+    @commands.is_owner()
+    async def stats(self, ctx: commands.Context[Nameless]):
+        """View crossover relay statistics."""
+        await ctx.defer()
+
+        metrics = self.bot.crossover_metrics
+        queues = self.bot.crossover_scheduler.stats()
+        busiest = "\n".join(f"<#{channel_id}>: {depth}" for channel_id, depth in queues.busiest)
+
+        embed = (
+            discord.Embed(
+                description="Crossover relay work since startup.",
+                color=discord.Colour.orange(),
+                title="Crossover statistics",
+            )
+            .add_field(
+                name="Attachments downloaded",
+                value=f"{metrics.attachment_bytes_downloaded:,} byte(s)",
+            )
+            .add_field(
+                name="Attachment downloads saved",
+                value=f"{metrics.attachment_bytes_saved:,} byte(s)",
+            )
+            .add_field(
+                name="Edits",
+                value=(
+                    f"{metrics.edits_skipped} unchanged skipped, "
+                    + f"{metrics.edits_collapsed} collapsed"
+                ),
+            )
+            .add_field(
+                name="Handed over",
+                value=(
+                    f"{metrics.relays_handed_over} to other workers, "
+                    + f"{metrics.hand_over_fallbacks} sent from here instead"
+                ),
+            )
+            .add_field(name="Queued relays", value=f"{queues.queued}")
+            .add_field(
+                name="Queue wait",
+                value=f"{queues.average_wait:.2f}s on average, {queues.max_wait:.2f}s at most",
+            )
+            .add_field(name="Rate limited", value=f"{queues.rate_limited} time(s)")
+            .add_field(name="Busiest channels", value=busiest or "None", inline=False)
         )
 
+        await ctx.send(embed=embed)
+
+    @crossover.command()
+    @commands.guild_only()
+    @commands.has_guild_permissions()
+    async def list(self, ctx: commands.Context[Nameless]):
+        await ctx.defer()
+
+        assert ctx.guild is not None
+        assert ctx.channel is not None
+
         embed = discord.Embed(
             description="All available connections, both in/outbound!",
             color=discord.Colour.orange(),
             title="Connection list",
         )
 
-        rooms: list[str] = [conn.RoomId for conn in connections]
+        rooms: list[str] = self.bot.crossover_routes.get_rooms(ctx.guild.id, ctx.channel.id)
 
         embed.set_thumbnail(url=ctx.guild.icon.url if ctx.guild.icon else "")
         embed.add_field(name="All connected rooms", value=f"`{'\n'.join(rooms)}`")
@@ -31,6 +31,7 @@ class GeneralCommand(commands.Cog):
 
         account_create_date = member.created_at
         join_date = member.joined_at
+        owner_id = member.guild.owner_id
 
         assert join_date is not None
 
@@ -40,7 +41,7 @@ class GeneralCommand(commands.Cog):
                 description=f"Public handle: `@{member.name}`",
                 timestamp=datetime.now(),
                 title=f"@{member.display_name} - "
-                + ("[👑]" if member.guild.owner == member else "[😎]")
+                + ("[👑]" if owner_id == member.id else "[😎]")
                 + ("[🤖]" if member.bot else ""),
                 color=discord.Color.orange(),
             )
@@ -67,11 +68,8 @@ class GeneralCommand(commands.Cog):
         assert guild is not None
 
         guild_create_date = guild.created_at
-        members = guild.members
-
-        bots_count = len([member for member in members if member.bot])
-        humans_count = len([member for member in members if not member.bot])
-        total_count = bots_count + humans_count
+        headcount = ctx.bot.population.get(guild.id)
+        owner = await ctx.bot.member_cache.get(guild, guild.owner_id) if guild.owner_id else None
         public_threads_count = len([thread for thread in guild.threads])
         events = guild.scheduled_events
         boosts_count = guild.premium_subscription_count
@@ -79,9 +77,7 @@ class GeneralCommand(commands.Cog):
         embed = (
             discord.Embed(
                 description=(
-                    f"Owner: {guild.owner.mention}"
-                    if guild.owner
-                    else "'Guild Member' intent missing."
+                    f"Owner: {owner.mention}" if owner else "'Guild Member' intent missing."
                 ),
                 timestamp=datetime.now(),
                 title=guild.name,
@@ -91,8 +87,9 @@ class GeneralCommand(commands.Cog):
             .add_field(name="ℹ️ Guild ID", value=f"{guild.id}")
             .add_field(name="⏰ Creation date", value=f"<t:{int(guild_create_date.timestamp())}:f>")
             .add_field(
-                name=f"👋 Headcount: {total_count}",
-                value=f"BOT: {bots_count}, Human: {humans_count}",
+                name=f"👋 Headcount: {headcount.total}",
+                value=f"BOT: {headcount.bots}, Human: {headcount.humans}"
+                + (f", Unknown: {headcount.unknown}" if headcount.unknown else ""),
             )
             .add_field(
                 name="💬 Channels",
@@ -117,7 +114,7 @@ class GeneralCommand(commands.Cog):
         assert ctx.bot.user is not None
 
         servers_count = len(ctx.bot.guilds)
-        total_members_count = sum(len(guild.members) for guild in ctx.bot.guilds)
+        total_members_count = ctx.bot.population.overall.total
 
         launch_time: datetime = nameless_config["nameless"]["start_time"]
 
@@ -1,10 +1,10 @@
 import logging
-import os
-import sys
 
+import discord
 from discord.ext import commands
 
 from nameless import Nameless
+from nameless.custom import get_rss
 
 __all__ = ["OwnerCommand"]
 
@@ -31,7 +31,7 @@ class OwnerCommand(commands.Cog):
         await ctx.defer()
         await ctx.send("See you soon!")
 
-        os.execl(sys.executable, sys.executable, *sys.argv)
+        await ctx.bot.restart()
 
     @commands.hybrid_command()
     @commands.is_owner()
@@ -45,6 +45,50 @@ class OwnerCommand(commands.Cog):
 
         await ctx.send("Done reloading all commands.")
 
+    @commands.hybrid_command()
+    @commands.is_owner()
+    async def memory(self, ctx: commands.Context[Nameless]):
+        """View memory use, to compare the default and low-memory profiles."""
+        await ctx.defer()
+
+        bot = ctx.bot
+
+        embed = (
+            discord.Embed(
+                description="Memory use of this process.",
+                color=discord.Colour.orange(),
+                title="Memory report",
+            )
+            .add_field(name="Profile", value="Low-memory" if bot.low_memory else "Default")
+            .add_field(name="RSS", value=f"{get_rss() / 1024**2:.1f} MiB")
+            .add_field(name="Cached guilds", value=f"{len(bot.guilds)}")
+            .add_field(name="Cached members", value=f"{sum(len(x.members) for x in bot.guilds)}")
+            .add_field(name="Cached messages", value=f"{len(bot.cached_messages)}")
+        )
+
+        await ctx.send(embed=embed)
+
+    @commands.hybrid_command()
+    @commands.is_owner()
+    async def shards(self, ctx: commands.Context[Nameless]):
+        """View latency and guild count of the shards this worker owns."""
+        await ctx.defer()
+
+        bot = ctx.bot
+
+        embed = discord.Embed(
+            description=f"Worker {bot.worker_id}." if bot.worker_id is not None else None,
+            color=discord.Colour.orange(),
+            title="Shard report",
+        )
+
+        for shard_id, latency, guilds in bot.shard_report()[:25]:
+            embed.add_field(
+                name=f"Shard {shard_id}", value=f"{latency * 1000:.0f}ms, {guilds} guild(s)"
+            )
+
+        await ctx.send(embed=embed)
+
     @commands.hybrid_command()
     @commands.is_owner()
     async def wipe_commands(self, ctx: commands.Context[Nameless]):
@@ -57,6 +101,7 @@ class OwnerCommand(commands.Cog):
 
         ctx.bot.tree.clear_commands(guild=None)
         await ctx.bot.tree.sync(guild=None)
+        ctx.bot.clear_command_hash()
 
         await ctx.send("Command cleaning done, you should restart me to update the new commands.")
 
@@ -1 +1,5 @@
+from .crossover import *
 from .crud import *
+from .memory import *
+from .population import *
+from .session import *
@@ -0,0 +1,8 @@
+from .bus import *
+from .messages import *
+from .metrics import *
+from .outbox import *
+from .resolver import *
+from .retention import *
+from .routing import *
+from .scheduler import *
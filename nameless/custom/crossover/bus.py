@@ -0,0 +1,258 @@
+import asyncio
+import contextlib
+import json
+import logging
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from typing import Any
+
+__all__ = ["CrossOverBusHandler", "CrossOverRelayBus"]
+
+# Handlers queue a job and return what to wait on until it ran, or None if it already did.
+CrossOverBusHandler = Callable[[dict[str, Any]], Awaitable[asyncio.Future[None] | None]]
+
+# Longest frame a worker reads, frames are one JSON document per line.
+_max_frame = 2**24
+
+
+class _Peer:
+    """Connection to another worker, and the jobs waiting on it."""
+
+    def __init__(self, max_pending: int) -> None:
+        self.slots: asyncio.Semaphore = asyncio.Semaphore(max_pending)
+        self.batch: list[tuple[dict[str, Any], asyncio.Future[bool]]] = []
+        self.frames: dict[int, list[asyncio.Future[bool]]] = {}
+
+        self.lock: asyncio.Lock = asyncio.Lock()
+        self.writer: asyncio.StreamWriter | None = None
+        self.reader: asyncio.Task[None] | None = None
+
+
+class CrossOverRelayBus:
+    """
+    Hand crossover work to the worker process owning the target guild.
+
+    Every worker launched by `launcher.py` listens on a Unix socket in
+    `socket_dir`. Jobs sent to the same worker in one loop iteration go out
+    as one frame, acknowledged once all of its jobs ran. A worker takes at
+    most `max_pending` jobs at once from its peers, and stops reading while
+    full, so a busy worker holds back the senders rather than queueing
+    without bound. A sender waits `send_timeout` seconds at most per job.
+    """
+
+    def __init__(
+        self,
+        socket_dir: Path,
+        worker_id: int | None,
+        worker_count: int,
+        shard_count: int,
+        max_pending: int,
+        send_timeout: float,
+    ) -> None:
+        self._socket_dir: Path = socket_dir
+        self._worker_id: int | None = worker_id
+        self._worker_count: int = worker_count
+        self._shard_count: int = shard_count
+        self._max_pending: int = max_pending
+        self._send_timeout: float = send_timeout
+
+        self._capacity: asyncio.Semaphore = asyncio.Semaphore(max_pending)
+        self._server: asyncio.Server | None = None
+        self._peers: dict[int, _Peer] = {}
+        self._last_frame: int = 0
+        self._tasks: set[asyncio.Task[Any]] = set()
+
+        self.handler: CrossOverBusHandler | None = None
+
+    @property
+    def enabled(self) -> bool:
+        """Whether guilds are split across several workers."""
+        return self._worker_id is not None and self._worker_count > 1
+
+    def owner(self, guild_id: int) -> int | None:
+        """Worker owning a guild, or None if it is this one."""
+        if not self.enabled:
+            return None
+
+        # Inverse of the contiguous shard ranges `launcher.py` hands out.
+        shard_id = (guild_id >> 22) % self._shard_count
+        worker_id = ((shard_id + 1) * self._worker_count - 1) // self._shard_count
+
+        return worker_id if worker_id != self._worker_id else None
+
+    async def start(self):
+        """Start taking jobs from other workers."""
+        if not self.enabled:
+            return
+
+        assert self._worker_id is not None
+
+        path = self._path(self._worker_id)
+        path.unlink(missing_ok=True)
+
+        self._server = await asyncio.start_unix_server(self._serve, path, limit=_max_frame)
+        logging.info("Crossover relay bus listening on %s.", path)
+
+    async def close(self):
+        """Stop taking jobs, and give up on those still waiting on other workers."""
+        if self._server is not None:
+            self._server.close()
+            assert self._worker_id is not None
+            self._path(self._worker_id).unlink(missing_ok=True)
+
+        for peer in self._peers.values():
+            if peer.writer is not None:
+                peer.writer.close()
+
+            if peer.reader is not None:
+                peer.reader.cancel()
+
+        await asyncio.gather(
+            *[x.reader for x in self._peers.values() if x.reader is not None],
+            return_exceptions=True,
+        )
+
+    async def send(self, worker_id: int, job: dict[str, Any]) -> bool:
+        """
+        Hand a job to another worker, waiting while that worker is full.
+
+        Return whether the job ran there. If it did not, it may or may not have,
+        and carrying it out locally is up to the caller.
+        """
+        peer = self._peers.setdefault(worker_id, _Peer(self._max_pending))
+        done = asyncio.get_running_loop().create_future()
+
+        try:
+            async with asyncio.timeout(self._send_timeout), peer.slots:
+                if not peer.batch:
+                    self._spawn(self._flush(worker_id, peer))
+
+                peer.batch.append((job, done))
+
+                return await done
+        except TimeoutError:
+            # Still batched means it never went out, and it must not after the caller moved on.
+            peer.batch = [x for x in peer.batch if x[1] is not done]
+            logging.warning(
+                "Crossover worker %d did not take a %s job in time.", worker_id, job.get("kind")
+            )
+            return False
+
+    def broadcast(self, job: dict[str, Any]):
+        """Hand a job to every other worker, without waiting for it."""
+        for worker_id in range(self._worker_count):
+            if self.enabled and worker_id != self._worker_id:
+                self._spawn(self.send(worker_id, job))
+
+    def _path(self, worker_id: int) -> Path:
+        return self._socket_dir / f"crossover-{worker_id}.sock"
+
+    def _spawn(self, coro: Awaitable[Any]):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, worker_id: int, peer: _Peer):
+        """Send the jobs batched for a worker as one frame."""
+        async with peer.lock:
+            batch, peer.batch = peer.batch, []
+
+            if not batch:
+                return
+
+            self._last_frame += 1
+            frame_id = self._last_frame
+            peer.frames[frame_id] = [done for _, done in batch]
+
+            try:
+                if peer.writer is None or peer.writer.is_closing():
+                    reader, peer.writer = await asyncio.open_unix_connection(
+                        self._path(worker_id), limit=_max_frame
+                    )
+                    peer.reader = asyncio.create_task(self._read_acks(peer, reader))
+
+                frame = {"frame": frame_id, "jobs": [job for job, _ in batch]}
+                peer.writer.write(json.dumps(frame).encode() + b"\n")
+                await peer.writer.drain()
+            except OSError:
+                logging.warning("Crossover worker %d is unreachable.", worker_id)
+
+                for done in peer.frames.pop(frame_id, []):
+                    if not done.done():
+                        done.set_result(False)
+
+    async def _read_acks(self, peer: _Peer, reader: asyncio.StreamReader):
+        """Settle jobs as their frames get acknowledged, until the connection drops."""
+        try:
+            while line := await reader.readline():
+                ack = json.loads(line)
+
+                for done in peer.frames.pop(ack["ack"], []):
+                    if not done.done():
+                        done.set_result(ack["ran"])
+        except (OSError, ValueError):
+            logging.warning("Lost a crossover bus connection.", exc_info=True)
+        finally:
+            if peer.writer is not None:
+                peer.writer.close()
+                peer.writer = None
+
+            for frame in peer.frames.values():
+                for done in frame:
+                    if not done.done():
+                        done.set_result(False)
+
+            peer.frames.clear()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Run jobs from one other worker, in the order they were sent."""
+        try:
+            while line := await reader.readline():
+                frame = json.loads(line)
+                waits: list[asyncio.Future[None]] = []
+                ran = self.handler is not None
+
+                for job in frame["jobs"]:
+                    # Not reading on while full is what holds the sender back.
+                    await self._capacity.acquire()
+                    waits.append(await self._run(job))
+
+                self._spawn(self._acknowledge(writer, frame["frame"], waits, ran))
+        except (OSError, ValueError):
+            logging.warning("Dropped a broken crossover bus connection.", exc_info=True)
+        finally:
+            writer.close()
+
+    async def _run(self, job: dict[str, Any]) -> asyncio.Future[None]:
+        done: asyncio.Future[None] | None = None
+
+        if self.handler is not None:
+            try:
+                done = await self.handler(job)
+            except Exception:
+                logging.exception("Failed to take a %s job from another worker.", job.get("kind"))
+
+        if done is None:
+            done = asyncio.get_running_loop().create_future()
+            done.set_result(None)
+
+        return done
+
+    async def _acknowledge(
+        self,
+        writer: asyncio.StreamWriter,
+        frame_id: int,
+        waits: list[asyncio.Future[None]],
+        ran: bool,
+    ):
+        await asyncio.gather(*waits, return_exceptions=True)
+
+        for _ in waits:
+            self._capacity.release()
+
+        # Jobs refused while draining did not run either.
+        ran = ran and not any(x.cancelled() for x in waits)
+
+        with contextlib.suppress(OSError):
+            writer.write(json.dumps({"ack": frame_id, "ran": ran}).encode() + b"\n")
+            await writer.drain()
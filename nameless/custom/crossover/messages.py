@@ -0,0 +1,227 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from collections.abc import Iterable
+from typing import NamedTuple
+
+import discord
+from prisma.models import CrossChatMessage, CrossChatRoomMember
+from prisma.types import CrossChatMessageCreateWithoutRelationsInput
+
+__all__ = ["CrossOverMessageLink", "CrossOverMessageStore"]
+
+
+class CrossOverMessageLink(NamedTuple):
+    """Where one relayed copy of a message lives."""
+
+    MemberId: str
+    TargetGuildId: int
+    TargetChannelId: int
+    ClonedMessageId: int
+    EmbedIndex: int | None = None
+
+
+class CrossOverMessageStore:
+    """
+    Origin -> cloned message mappings, with a write-behind buffer in front of the database.
+
+    Mappings are written in batches, once enough of them are buffered or
+    once the oldest one has waited long enough. Recently relayed messages
+    are answered from a bounded LRU cache, older ones from an indexed query.
+
+    Embeds of recent coalesced posts are kept as well, so one of their
+    origins can be edited without reading the post back.
+    """
+
+    def __init__(self, flush_size: int, flush_interval: float, cache_size: int) -> None:
+        self._flush_size: int = flush_size
+        self._flush_interval: float = flush_interval
+        self._cache_size: int = cache_size
+
+        self._pending: list[CrossChatMessageCreateWithoutRelationsInput] = []
+        self._pending_by_origin: dict[int, list[CrossOverMessageLink]] = {}
+        self._cache: OrderedDict[int, list[CrossOverMessageLink]] = OrderedDict()
+        self._posts: OrderedDict[int, list[discord.Embed]] = OrderedDict()
+        # Results of lookups still querying, so mappings recorded meanwhile reach them.
+        self._lookups: dict[int, list[list[CrossOverMessageLink]]] = {}
+
+        self._lock: asyncio.Lock = asyncio.Lock()
+        self._timer: asyncio.Task[None] | None = None
+        self._flushes: set[asyncio.Task[int]] = set()
+
+    def record(
+        self,
+        member: CrossChatRoomMember,
+        origin_id: int,
+        cloned_id: int,
+        embed_index: int | None = None,
+    ) -> CrossOverMessageLink:
+        """Buffer a new mapping, and return it."""
+        link = CrossOverMessageLink(
+            member.Id, member.GuildId, member.ChannelId, cloned_id, embed_index
+        )
+
+        row: CrossChatMessageCreateWithoutRelationsInput = {
+            "MemberId": member.Id,
+            "OriginMessageId": origin_id,
+            "ClonedMessageId": cloned_id,
+        }
+
+        if embed_index is not None:
+            row["EmbedIndex"] = embed_index
+
+        self._pending.append(row)
+        self._pending_by_origin.setdefault(origin_id, []).append(link)
+
+        for links in self._lookups.get(origin_id, []):
+            links.append(link)
+
+        # An uncached origin may have copies written already, caching this one alone would hide
+        # them. The next lookup reads them all.
+        if origin_id in self._cache:
+            self._cache[origin_id].append(link)
+            self._cache.move_to_end(origin_id)
+
+        if len(self._pending) >= self._flush_size:
+            flush = asyncio.create_task(self.flush())
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+        else:
+            self._schedule()
+
+        return link
+
+    def track(self, origin_id: int):
+        """Cache a message about to be relayed for the first time, as having no copies yet."""
+        if origin_id not in self._cache and origin_id not in self._pending_by_origin:
+            self._remember(origin_id, [])
+
+    async def lookup(self, origin_id: int, fresh: bool = False) -> list[CrossOverMessageLink]:
+        """Get all relayed copies of this origin message."""
+        return (await self.lookup_many([origin_id], fresh))[origin_id]
+
+    async def lookup_many(
+        self, origin_ids: Iterable[int], fresh: bool = False
+    ) -> dict[int, list[CrossOverMessageLink]]:
+        """
+        Get all relayed copies of several origin messages, in at most one query.
+
+        The cache only learns of copies recorded by this process. With `fresh`,
+        the database is read regardless, for copies other workers recorded.
+        """
+        result: dict[int, list[CrossOverMessageLink]] = {}
+        missing: list[int] = []
+
+        for origin_id in origin_ids:
+            if origin_id in self._cache and not fresh:
+                self._cache.move_to_end(origin_id)
+                result[origin_id] = self._cache[origin_id]
+            else:
+                # Taken first, so a batch written during the query below is not missed.
+                result[origin_id] = [*self._pending_by_origin.get(origin_id, [])]
+                missing.append(origin_id)
+
+        if not missing:
+            return result
+
+        for origin_id in missing:
+            self._lookups.setdefault(origin_id, []).append(result[origin_id])
+
+        try:
+            rows = await CrossChatMessage.prisma().find_many(
+                where={"OriginMessageId": {"in": missing}}, include={"Member": True}
+            )
+        finally:
+            for origin_id in missing:
+                waiting = [x for x in self._lookups[origin_id] if x is not result[origin_id]]
+
+                if waiting:
+                    self._lookups[origin_id] = waiting
+                else:
+                    del self._lookups[origin_id]
+
+        for row in rows:
+            if row.Member is None:
+                continue
+
+            link = CrossOverMessageLink(
+                row.Member.Id,
+                row.Member.GuildId,
+                row.Member.ChannelId,
+                row.ClonedMessageId,
+                row.EmbedIndex,
+            )
+            links = result[row.OriginMessageId]
+
+            if link not in links:
+                links.append(link)
+
+        for origin_id in missing:
+            cached = self._cache.get(origin_id)
+
+            if cached is None:
+                self._remember(origin_id, result[origin_id])
+                continue
+
+            # Another lookup of the same origin finished first, both saw every new mapping.
+            cached.extend(x for x in result[origin_id] if x not in cached)
+            self._cache.move_to_end(origin_id)
+            result[origin_id] = cached
+
+        return result
+
+    def remember_post(self, cloned_id: int, embeds: list[discord.Embed]):
+        """Keep the current embeds of a coalesced post."""
+        self._posts[cloned_id] = embeds
+        self._posts.move_to_end(cloned_id)
+
+        if len(self._posts) > self._cache_size:
+            self._posts.popitem(last=False)
+
+    def get_post(self, cloned_id: int) -> list[discord.Embed] | None:
+        """Get the current embeds of a coalesced post, if still kept."""
+        return self._posts.get(cloned_id)
+
+    async def flush(self) -> int:
+        """Write all buffered mappings in one batch, returning how many were written."""
+        async with self._lock:
+            rows, self._pending = self._pending, []
+
+            if not rows:
+                return 0
+
+            try:
+                await CrossChatMessage.prisma().create_many(data=rows)
+            except Exception:
+                logging.exception("Failed to write %d crossover mapping(s), will retry.", len(rows))
+                self._pending[:0] = rows
+                self._schedule()
+                return 0
+
+            for row in rows:
+                origin_id = row["OriginMessageId"]
+                origin_links = self._pending_by_origin[origin_id]
+                del origin_links[0]
+
+                if not origin_links:
+                    del self._pending_by_origin[origin_id]
+
+            logging.debug("Wrote %d crossover mapping(s).", len(rows))
+            return len(rows)
+
+    def _remember(self, origin_id: int, links: list[CrossOverMessageLink]):
+        """Put an entry in the LRU cache, evicting the least recent one if full."""
+        self._cache[origin_id] = links
+
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    def _schedule(self):
+        """Make sure a time-based flush is coming."""
+        if self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self._flush_interval)
+        self._timer = None
+        await self.flush()
@@ -0,0 +1,15 @@
+from dataclasses import dataclass
+
+__all__ = ["CrossOverMetrics"]
+
+
+@dataclass
+class CrossOverMetrics:
+    """Running counters of crossover relay work, since startup."""
+
+    attachment_bytes_downloaded: int = 0
+    attachment_bytes_saved: int = 0
+    edits_skipped: int = 0
+    edits_collapsed: int = 0
+    relays_handed_over: int = 0
+    hand_over_fallbacks: int = 0
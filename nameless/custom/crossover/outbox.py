@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from typing import Literal, NamedTuple
+
+from prisma.models import CrossChatOutbox
+from prisma.types import CrossChatOutboxCreateWithoutRelationsInput, CrossChatOutboxWhereInput
+
+__all__ = [
+    "CrossOverOutbox",
+    "CrossOverOutboxEntry",
+    "CrossOverOutboxKind",
+    "CrossOverOutboxReplayer",
+]
+
+CrossOverOutboxKind = Literal["relay", "edit", "delete"]
+CrossOverOutboxReplayer = Callable[[list[CrossChatOutbox]], Awaitable[None]]
+
+# Ids are microseconds times this plus the worker id, so workers never take the same one.
+_max_workers = 1024
+
+
+class CrossOverOutboxEntry(NamedTuple):
+    """Handle to an outbox entry, with a way to wait until it is persisted."""
+
+    entry_id: int
+    written: asyncio.Event
+
+
+class CrossOverOutbox:
+    """
+    Crossover work recorded before it is carried out, so a restart can replay it.
+
+    Entries added in the same loop iteration are written in one batch, and
+    completed ones are removed in batches, once enough time has passed.
+    Entries left over from an earlier run are handed to `replayer` on
+    startup, `replay_batch_size` at a time and in the order they were added.
+    Those older than `max_age` seconds are dropped instead.
+
+    Each launcher worker replays only the entries it recorded itself, as the
+    others may still be carrying theirs out. Worker 0 also takes those of
+    workers that are gone, after the worker count went down.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float,
+        replay_batch_size: int,
+        max_age: float,
+        worker_id: int,
+        worker_count: int,
+    ) -> None:
+        self._flush_interval: float = flush_interval
+        self._replay_batch_size: int = replay_batch_size
+        self._max_age: float = max_age
+        self._worker_id: int = worker_id
+        self._worker_count: int = worker_count
+
+        # Anything below this was added by an earlier run.
+        self._replay_before: int = time.time_ns() // 1000 * _max_workers
+        self._last_id: int = self._replay_before + worker_id - _max_workers
+
+        self._writes: list[CrossChatOutboxCreateWithoutRelationsInput] = []
+        self._written: asyncio.Event = asyncio.Event()
+        self._completed: list[int] = []
+
+        self._lock: asyncio.Lock = asyncio.Lock()
+        self._timer: asyncio.Task[None] | None = None
+        self._writes_in_flight: set[asyncio.Task[int]] = set()
+
+        self.replayer: CrossOverOutboxReplayer | None = None
+
+    def add(
+        self,
+        kind: CrossOverOutboxKind,
+        origin_id: int,
+        payload: str,
+        member_id: str | None = None,
+    ) -> CrossOverOutboxEntry:
+        """Record work about to be carried out. Wait on `written` before carrying it out."""
+        self._last_id = max(
+            self._last_id + _max_workers, time.time_ns() // 1000 * _max_workers + self._worker_id
+        )
+
+        row: CrossChatOutboxCreateWithoutRelationsInput = {
+            "Id": self._last_id,
+            "Kind": kind,
+            "OriginMessageId": origin_id,
+            "Payload": payload,
+            "WorkerId": self._worker_id,
+        }
+
+        if member_id is not None:
+            row["MemberId"] = member_id
+
+        if not self._writes:
+            self._written = asyncio.Event()
+
+            write = asyncio.create_task(self._write())
+            self._writes_in_flight.add(write)
+            write.add_done_callback(self._writes_in_flight.discard)
+
+        self._writes.append(row)
+
+        return CrossOverOutboxEntry(self._last_id, self._written)
+
+    def complete(self, entry: CrossOverOutboxEntry):
+        """Mark recorded work as carried out."""
+        self._completed.append(entry.entry_id)
+
+        if self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def flush(self) -> int:
+        """Write pending entries and remove completed ones, returning how many were handled."""
+        written = await self._write()
+
+        async with self._lock:
+            entry_ids, self._completed = self._completed, []
+
+            if not entry_ids:
+                return written
+
+            try:
+                await CrossChatOutbox.prisma().delete_many(where={"Id": {"in": entry_ids}})
+            except Exception:
+                logging.exception("Failed to clear %d crossover outbox entries.", len(entry_ids))
+                self._completed[:0] = entry_ids
+                return written
+
+            return written + len(entry_ids)
+
+    async def replay(self):
+        """Hand entries left over from an earlier run to the replayer."""
+        if self.replayer is None:
+            logging.warning("Nothing replays the crossover outbox, leaving it for the next run.")
+            return
+
+        replayed = 0
+
+        owned: CrossChatOutboxWhereInput = {"WorkerId": self._worker_id}
+
+        if self._worker_id == 0:
+            owned = {"OR": [owned, {"WorkerId": {"gte": self._worker_count}}]}
+
+        # Ids start with the time they were added at, so the stale ones all sort first.
+        oldest = (time.time_ns() // 1000 - int(self._max_age * 1_000_000)) * _max_workers
+        stale = await CrossChatOutbox.prisma().delete_many(where={"Id": {"lt": oldest}, **owned})
+        last_id = oldest - 1
+
+        if stale:
+            logging.warning("Dropped %d stale crossover outbox entries.", stale)
+
+        while rows := await CrossChatOutbox.prisma().find_many(
+            where={"Id": {"gt": last_id, "lt": self._replay_before}, **owned},
+            order={"Id": "asc"},
+            take=self._replay_batch_size,
+        ):
+            try:
+                await self.replayer(rows)
+            except Exception:
+                # Dropped rather than retried, or a poisoned batch would come back every run.
+                logging.exception("Failed to replay %d crossover outbox entries.", len(rows))
+
+            last_id = rows[-1].Id
+            replayed += len(rows)
+
+            await CrossChatOutbox.prisma().delete_many(
+                where={"Id": {"in": [row.Id for row in rows]}}
+            )
+
+        if replayed:
+            logging.info("Replayed %d crossover outbox entries.", replayed)
+
+    async def _write(self) -> int:
+        """Write the entries added so far in one batch, returning how many were written."""
+        async with self._lock:
+            rows, self._writes = self._writes, []
+            written = self._written
+
+            if not rows:
+                return 0
+
+            try:
+                await CrossChatOutbox.prisma().create_many(data=rows)
+            except Exception:
+                # The work itself still goes ahead, it just can not be replayed.
+                logging.exception("Failed to record %d crossover outbox entries.", len(rows))
+                return 0
+            finally:
+                written.set()
+
+            return len(rows)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self._flush_interval)
+        self._timer = None
+        await self.flush()
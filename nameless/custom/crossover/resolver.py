@@ -0,0 +1,84 @@
+import time
+from collections import OrderedDict
+from typing import Any
+
+import discord
+
+__all__ = ["CrossOverResolver"]
+
+_resolved_channel = discord.abc.GuildChannel | discord.Thread | discord.abc.PrivateChannel
+
+
+class CrossOverResolver:
+    """
+    Resolve guilds and channels from the gateway cache first.
+
+    Anything missing from the gateway cache (uncached threads, mostly) is
+    fetched over REST. Fetch results are kept for `ttl` seconds and failed
+    fetches for `negative_ttl` seconds, so a hot route never fetches twice
+    in a row. At most `size` guilds and `size` channels are kept at once.
+    """
+
+    def __init__(self, client: discord.Client, ttl: float, negative_ttl: float, size: int) -> None:
+        self._client: discord.Client = client
+        self._ttl: float = ttl
+        self._negative_ttl: float = negative_ttl
+        self._size: int = size
+
+        self._guilds: OrderedDict[int, tuple[float, discord.Guild | None]] = OrderedDict()
+        self._channels: OrderedDict[int, tuple[float, _resolved_channel | None]] = OrderedDict()
+
+    async def guild(self, guild_id: int) -> discord.Guild | None:
+        """Resolve a guild, or None if it is out of reach."""
+        guild = self._client.get_guild(guild_id)
+
+        if guild is not None:
+            return guild
+
+        cached = self._guilds.get(guild_id)
+
+        if cached is not None and cached[0] > time.monotonic():
+            self._guilds.move_to_end(guild_id)
+            return cached[1]
+
+        try:
+            guild = await self._client.fetch_guild(guild_id)
+        except discord.HTTPException:
+            guild = None
+
+        self._remember(self._guilds, guild_id, guild)
+        return guild
+
+    async def channel(self, guild_id: int, channel_id: int) -> _resolved_channel | None:
+        """Resolve a channel or thread, or None if it is out of reach."""
+        guild = self._client.get_guild(guild_id)
+
+        if guild is not None:
+            channel = guild.get_channel_or_thread(channel_id)
+
+            if channel is not None:
+                return channel
+
+        cached = self._channels.get(channel_id)
+
+        if cached is not None and cached[0] > time.monotonic():
+            self._channels.move_to_end(channel_id)
+            return cached[1]
+
+        try:
+            channel = await self._client.fetch_channel(channel_id)
+        except (discord.HTTPException, discord.InvalidData):
+            channel = None
+
+        self._remember(self._channels, channel_id, channel)
+        return channel
+
+    def _remember(self, cache: OrderedDict[int, tuple[float, Any]], key: int, value: object):
+        """Keep a fetch result until it expires, evicting the least recent one if full."""
+        ttl = self._ttl if value is not None else self._negative_ttl
+
+        cache[key] = (time.monotonic() + ttl, value)
+        cache.move_to_end(key)
+
+        if len(cache) > self._size:
+            cache.popitem(last=False)
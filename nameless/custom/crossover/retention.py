@@ -0,0 +1,108 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from discord.ext import tasks
+from prisma.models import CrossChatMessage, CrossChatRoomMember
+
+from nameless.custom.crud import NamelessPrisma
+
+__all__ = ["CrossOverRetention"]
+
+
+class CrossOverRetention:
+    """
+    Periodically prune old crossover mappings, then compact the database.
+
+    Mappings are removed when they are older than `max_age_days`, or when
+    their room member holds more than `max_rows_per_member` of them.
+    Deletes run `batch_size` rows at a time, so the database is never
+    locked for long and other queries can slip in between batches.
+    """
+
+    def __init__(
+        self,
+        max_age_days: int,
+        max_rows_per_member: int,
+        batch_size: int,
+        compaction: str,
+    ) -> None:
+        self.max_age_days: int = max_age_days
+        self.max_rows_per_member: int = max_rows_per_member
+        self.batch_size: int = batch_size
+        self.compaction: str = compaction
+
+        self._loop: tasks.Loop[Any] | None = None
+
+    def start(self, interval_minutes: float):
+        """Start running retention in the background."""
+        self._loop = tasks.loop(minutes=interval_minutes)(self._run_logged)
+        self._loop.start()
+
+    def stop(self):
+        """Stop the background retention, if it is running."""
+        if self._loop is not None:
+            self._loop.cancel()
+
+    async def run(self) -> int:
+        """Run one retention pass, returning the amount of pruned mappings."""
+        pruned = await self._prune_by_age() + await self._prune_by_cap()
+
+        if pruned:
+            await NamelessPrisma.compact(self.compaction)
+
+        return pruned
+
+    async def _run_logged(self):
+        try:
+            pruned = await self.run()
+            logging.info("Crossover retention pruned %d mapping(s).", pruned)
+        except Exception:
+            # An unhandled error would stop the loop for good.
+            logging.exception("Crossover retention failed, will retry next round.")
+
+    async def _prune_by_age(self) -> int:
+        """Remove mappings older than the configured age."""
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.max_age_days)
+        pruned = 0
+
+        while True:
+            rows = await CrossChatMessage.prisma().find_many(
+                where={"CreatedAt": {"lt": cutoff}}, take=self.batch_size
+            )
+
+            if not rows:
+                return pruned
+
+            pruned += await CrossChatMessage.prisma().delete_many(
+                where={"Id": {"in": [x.Id for x in rows]}}
+            )
+
+    async def _prune_by_cap(self) -> int:
+        """Remove the oldest mappings of room members holding too many of them."""
+        pruned = 0
+
+        for member in await CrossChatRoomMember.prisma().find_many():
+            excess = (
+                await CrossChatMessage.prisma().count(where={"MemberId": member.Id})
+                - self.max_rows_per_member
+            )
+
+            while excess > 0:
+                rows = await CrossChatMessage.prisma().find_many(
+                    where={"MemberId": member.Id},
+                    order={"CreatedAt": "asc"},
+                    take=min(excess, self.batch_size),
+                )
+
+                deleted = await CrossChatMessage.prisma().delete_many(
+                    where={"Id": {"in": [x.Id for x in rows]}}
+                )
+
+                pruned += deleted
+                excess -= deleted
+
+                if not deleted:
+                    break
+
+        return pruned
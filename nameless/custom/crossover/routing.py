@@ -0,0 +1,93 @@
+import logging
+
+from prisma.models import CrossChatConnection, CrossChatRoomMember
+
+from nameless.custom.crud import NamelessPrisma
+
+__all__ = ["CrossOverRoutingTable"]
+
+
+class CrossOverRoutingTable:
+    """
+    In-memory view of all crossover rooms and their member channels.
+
+    A message posted in a member channel goes to every other member of the
+    rooms it belongs to, so a lookup costs as much as the room is large.
+    """
+
+    def __init__(self) -> None:
+        self._rooms: dict[str, dict[tuple[int, int], CrossChatRoomMember]] = {}
+        self._memberships: dict[tuple[int, int], dict[str, CrossChatRoomMember]] = {}
+
+    async def load(self):
+        """(Re)load every room member from the database."""
+        await self._migrate_connections()
+
+        members = await CrossChatRoomMember.prisma().find_many()
+
+        self._rooms.clear()
+        self._memberships.clear()
+
+        for member in members:
+            self.add(member)
+
+        logging.info("Loaded %d crossover member(s) in %d room(s).", len(members), len(self._rooms))
+
+    def add(self, member: CrossChatRoomMember):
+        """Register a newly joined member."""
+        key = (member.GuildId, member.ChannelId)
+        self._rooms.setdefault(member.RoomId, {})[key] = member
+        self._memberships.setdefault(key, {})[member.RoomId] = member
+
+    def get(self, guild_id: int, channel_id: int) -> list[CrossChatRoomMember]:
+        """Get all members this channel relays to, across all of its rooms."""
+        key = (guild_id, channel_id)
+        result: dict[tuple[int, int], CrossChatRoomMember] = {}
+
+        for room_id in self._memberships.get(key, {}):
+            for other_key, member in self._rooms[room_id].items():
+                if other_key != key:
+                    result.setdefault(other_key, member)
+
+        return [*result.values()]
+
+    def find(self, room_id: str, guild_id: int, channel_id: int) -> CrossChatRoomMember | None:
+        """Get the member a channel is in a room as, if any."""
+        return self._rooms.get(room_id, {}).get((guild_id, channel_id))
+
+    def get_rooms(self, guild_id: int, channel_id: int) -> list[str]:
+        """Get IDs of all rooms this channel is a member of."""
+        return [*self._memberships.get((guild_id, channel_id), {})]
+
+    def is_bridged(self, guild_id: int, channel_id: int) -> bool:
+        """Return if this channel is a member of any room."""
+        return (guild_id, channel_id) in self._memberships
+
+    def is_member(self, room_id: str, guild_id: int, channel_id: int) -> bool:
+        """Return if this channel is a member of this room."""
+        return room_id in self._memberships.get((guild_id, channel_id), {})
+
+    async def _migrate_connections(self):
+        """Fold legacy pairwise connections into room members, keeping their messages."""
+        connections = await CrossChatConnection.prisma().find_many()
+
+        # Every step is idempotent, an interrupted migration simply resumes on next start.
+        for conn in connections:
+            target = await NamelessPrisma.get_room_member_entry(
+                conn.RoomId, conn.TargetGuildId, conn.TargetChannelId
+            )
+
+            if conn.SourceGuildId is not None:
+                await NamelessPrisma.get_room_member_entry(
+                    conn.RoomId, conn.SourceGuildId, conn.SourceChannelId
+                )
+
+            await NamelessPrisma.move_connection_messages(conn.Id, target.Id)
+
+            await CrossChatConnection.prisma().delete(where={"Id": conn.Id})
+
+        if connections:
+            logging.warning(
+                "Migrated %d pairwise crossover connection(s) into room members.",
+                len(connections),
+            )
@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import NamedTuple
+
+import discord
+
+__all__ = ["CrossOverScheduler", "CrossOverSchedulerStats", "RelayJob"]
+
+RelayJob = Callable[[], Awaitable[None]]
+
+
+class CrossOverSchedulerStats(NamedTuple):
+    """Point-in-time view of the relay queues."""
+
+    queued: int
+    busiest: list[tuple[int, int]]
+    average_wait: float
+    max_wait: float
+    rate_limited: int
+
+
+class _QueuedJob(NamedTuple):
+    job: RelayJob
+    enqueued_at: float
+    done: asyncio.Future[None]
+
+
+class _ChannelBucket:
+    """Local view of one channel's send rate limit, as a token bucket."""
+
+    def __init__(self, rate: int, per: float) -> None:
+        self.rate: int = rate
+        self.per: float = per
+
+        self.tokens: float = rate
+        self.updated: float = time.monotonic()
+        self.blocked_until: float = 0.0
+
+    def delay(self) -> float:
+        """Seconds to wait before the next send may go out."""
+        now = time.monotonic()
+
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+
+        wait = max(self.blocked_until - now, 0.0)
+
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) * self.per / self.rate)
+
+        return wait
+
+    def consume(self):
+        self.tokens -= 1
+
+    def block(self, retry_after: float):
+        """Hold the channel back after Discord told us to."""
+        self.blocked_until = time.monotonic() + retry_after
+
+    def is_idle(self) -> bool:
+        """Return if the bucket holds no state worth keeping."""
+        return self.delay() == 0 and self.tokens >= self.rate
+
+
+class CrossOverScheduler:
+    """
+    Run relay jobs with one queue per target channel.
+
+    Every channel has its own worker and its own rate limit bucket, so a
+    throttled channel only ever delays itself. Jobs of the same channel run
+    in submission order. There is no cap shared across channels, as jobs
+    sleep inside discord.py while a channel is throttled, and would hold
+    it for nothing. The overall pace is left to discord.py's global limit.
+    """
+
+    def __init__(self, channel_rate: int, channel_per: float) -> None:
+        self._channel_rate: int = channel_rate
+        self._channel_per: float = channel_per
+
+        self._queues: dict[int, deque[_QueuedJob]] = {}
+        self._buckets: dict[int, _ChannelBucket] = {}
+        self._workers: dict[int, asyncio.Task[None]] = {}
+
+        self._waits: deque[float] = deque(maxlen=1000)
+        self._rate_limited: int = 0
+
+        self._accepting: bool = True
+
+    def submit(self, channel_id: int, job: RelayJob) -> asyncio.Future[None]:
+        """
+        Queue a job for a target channel, starting its worker if needed.
+
+        The returned future is done once the job ran, whether it succeeded or not.
+        Once draining, jobs are refused and their future is cancelled.
+        """
+        done = asyncio.get_running_loop().create_future()
+
+        if not self._accepting:
+            logging.warning("Refused a relay job for channel %s while draining.", channel_id)
+            done.cancel()
+            return done
+
+        queue = self._queues.setdefault(channel_id, deque())
+        queue.append(_QueuedJob(job, time.monotonic(), done))
+
+        if channel_id not in self._workers:
+            self._workers[channel_id] = asyncio.create_task(self._work(channel_id, queue))
+
+        return done
+
+    def depth(self, channel_id: int) -> int:
+        """Amount of jobs waiting for a channel."""
+        return len(self._queues.get(channel_id, ()))
+
+    def stats(self, top: int = 5) -> CrossOverSchedulerStats:
+        """Summarize queue depths and recent wait times."""
+        depths = sorted(
+            ((channel_id, len(queue)) for channel_id, queue in self._queues.items()),
+            key=lambda x: x[1],
+            reverse=True,
+        )
+
+        return CrossOverSchedulerStats(
+            queued=sum(depth for _, depth in depths),
+            busiest=depths[:top],
+            average_wait=sum(self._waits) / len(self._waits) if self._waits else 0.0,
+            max_wait=max(self._waits, default=0.0),
+            rate_limited=self._rate_limited,
+        )
+
+    async def drain(self, timeout: float) -> tuple[int, int]:
+        """
+        Stop taking jobs, and give the queued ones up to `timeout` seconds to run.
+
+        Return how many queued jobs ran, and how many were dropped.
+        """
+        self._accepting = False
+
+        queued = sum(len(queue) for queue in self._queues.values())
+        workers = [*self._workers.values()]
+
+        if not workers:
+            return 0, 0
+
+        _, unfinished = await asyncio.wait(workers, timeout=timeout)
+
+        dropped = 0
+
+        for queue in self._queues.values():
+            dropped += len(queue)
+
+            for entry in queue:
+                entry.done.cancel()
+
+        for worker in unfinished:
+            worker.cancel()
+
+        await asyncio.gather(*unfinished, return_exceptions=True)
+
+        return queued - dropped, dropped
+
+    async def _work(self, channel_id: int, queue: deque[_QueuedJob]):
+        """Drain one channel queue, one job at a time."""
+        bucket = self._buckets.setdefault(
+            channel_id, _ChannelBucket(self._channel_rate, self._channel_per)
+        )
+
+        try:
+            while queue:
+                while (delay := bucket.delay()) > 0:
+                    await asyncio.sleep(delay)
+
+                bucket.consume()
+                entry = queue[0]
+                started = time.monotonic()
+
+                try:
+                    await entry.job()
+                except discord.RateLimited as ex:
+                    # Keep the job in front, and let the bucket hold this channel back.
+                    self._rate_limited += 1
+                    bucket.block(ex.retry_after)
+                    logging.warning(
+                        "Relays to channel %s are rate limited for %.2fs.",
+                        channel_id,
+                        ex.retry_after,
+                    )
+                    continue
+                except Exception:
+                    # One failing target must not take the others down with it.
+                    logging.exception("Relay job for channel %s failed.", channel_id)
+
+                self._waits.append(started - entry.enqueued_at)
+                queue.popleft()
+                entry.done.set_result(None)
+        finally:
+            del self._workers[channel_id]
+            del self._queues[channel_id]
+
+            if bucket.is_idle():
+                del self._buckets[channel_id]
@@ -1,3 +1,5 @@
+import logging
+
 import discord
 from prisma import Prisma, models
 
@@ -10,15 +12,47 @@ class NamelessPrisma:
     """A Prisma class to connect to Prisma ORM."""
 
     @staticmethod
-    async def init():
-        """Intialize Prisma connection."""
+    async def init(compaction: str = "none"):
+        """Intialize Prisma connection, with the database set up for `compaction` to work."""
         await _raw_db.connect()
 
+        match compaction:
+            case "checkpoint":
+                # Persisted in the database file. Without WAL there is nothing to checkpoint.
+                await _raw_db.query_raw("PRAGMA journal_mode = WAL")
+            case "incremental_vacuum":
+                auto_vacuum = await _raw_db.query_raw("PRAGMA auto_vacuum")
+
+                # 2 is INCREMENTAL, switching to it only applies after a full VACUUM.
+                # Done here, so the database is locked while starting rather than mid-run.
+                if auto_vacuum and auto_vacuum[0].get("auto_vacuum") != 2:
+                    logging.warning("Switching the database to incremental auto-vacuum.")
+                    await _raw_db.execute_raw("PRAGMA auto_vacuum = INCREMENTAL")
+                    await _raw_db.execute_raw("VACUUM")
+            case _:
+                pass
+
     @staticmethod
     async def dispose():
         """Properly dispose Prisma connection."""
         await _raw_db.disconnect()
 
+    @staticmethod
+    async def compact(mode: str):
+        """
+        Give space freed by deleted rows back.
+
+        `checkpoint` folds the WAL file back into the database, `incremental_vacuum`
+        releases free pages, `none` does nothing. Both rely on `init` with the same mode.
+        """
+        match mode:
+            case "checkpoint":
+                await _raw_db.query_raw("PRAGMA wal_checkpoint(TRUNCATE)")
+            case "incremental_vacuum":
+                await _raw_db.query_raw("PRAGMA incremental_vacuum")
+            case _:
+                pass
+
     @staticmethod
     async def get_guild_entry(guild: discord.Guild) -> models.Guild:
         """
@@ -27,3 +61,90 @@ class NamelessPrisma:
         return await _raw_db.guild.upsert(
             where={"Id": guild.id}, data={"create": {"Id": guild.id}, "update": {}}
         )
+
+    @staticmethod
+    async def get_room_member_entry(
+        room_id: str, guild_id: int, channel_id: int
+    ) -> models.CrossChatRoomMember:
+        """
+        Create a Prisma CrossChatRoomMember entry if not exists.
+        """
+        return await _raw_db.crosschatroommember.upsert(
+            where={
+                "RoomId_GuildId_ChannelId": {
+                    "RoomId": room_id,
+                    "GuildId": guild_id,
+                    "ChannelId": channel_id,
+                }
+            },
+            data={
+                "create": {"RoomId": room_id, "GuildId": guild_id, "ChannelId": channel_id},
+                "update": {},
+            },
+        )
+
+    @staticmethod
+    async def join_room(
+        room: models.CrossChatRoom, guild_id: int, channel_id: int
+    ) -> tuple[models.CrossChatRoomMember, models.CrossChatRoomMember] | None:
+        """
+        Add a channel to a room, along with the room host and both guilds, in one transaction.
+        Return the (host, new) members, or None if the channel already is a member.
+        """
+        async with _raw_db.tx() as tx:
+            existing = await tx.crosschatroommember.find_unique(
+                where={
+                    "RoomId_GuildId_ChannelId": {
+                        "RoomId": room.Id,
+                        "GuildId": guild_id,
+                        "ChannelId": channel_id,
+                    }
+                }
+            )
+
+            if existing is not None:
+                return None
+
+            for entry_id in {guild_id, room.GuildId}:
+                await tx.guild.upsert(
+                    where={"Id": entry_id}, data={"create": {"Id": entry_id}, "update": {}}
+                )
+
+            # Rooms made before members existed may not have their host registered yet.
+            host = await tx.crosschatroommember.upsert(
+                where={
+                    "RoomId_GuildId_ChannelId": {
+                        "RoomId": room.Id,
+                        "GuildId": room.GuildId,
+                        "ChannelId": room.ChannelId,
+                    }
+                },
+                data={
+                    "create": {
+                        "RoomId": room.Id,
+                        "GuildId": room.GuildId,
+                        "ChannelId": room.ChannelId,
+                    },
+                    "update": {},
+                },
+            )
+
+            member = await tx.crosschatroommember.create(
+                data={"RoomId": room.Id, "GuildId": guild_id, "ChannelId": channel_id}
+            )
+
+            return host, member
+
+    @staticmethod
+    async def move_connection_messages(connection_id: str, member_id: str) -> int:
+        """
+        Hand the messages relayed through a legacy connection over to a room member.
+        Return how many were moved.
+        """
+        # Relation scalars can not be set through update_many.
+        return await _raw_db.execute_raw(
+            'UPDATE "CrossChatMessage" SET "MemberId" = ?, "ConnectionId" = NULL '
+            'WHERE "ConnectionId" = ?',
+            member_id,
+            connection_id,
+        )
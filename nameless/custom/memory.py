@@ -0,0 +1,66 @@
+import os
+import resource
+import sys
+import time
+from collections import OrderedDict
+
+import discord
+
+__all__ = ["NamelessMemberCache", "get_rss"]
+
+
+def get_rss() -> int:
+    """Resident memory of this process in bytes, or its peak where the current one is unknown."""
+    try:
+        with open("/proc/self/statm", encoding="utf-8") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # Bytes on macOS, kilobytes elsewhere.
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class NamelessMemberCache:
+    """
+    Resolve members from the gateway cache first, fetching them when missing.
+
+    Meant for when members are not chunked. Fetch results are kept for
+    `ttl` seconds, and at most `size` of them at once, so repeated
+    lookups of the same member do not fetch again.
+    """
+
+    def __init__(self, ttl: float, size: int) -> None:
+        self._ttl: float = ttl
+        self._size: int = size
+
+        self._members: OrderedDict[tuple[int, int], tuple[float, discord.Member | None]] = (
+            OrderedDict()
+        )
+
+    async def get(self, guild: discord.Guild, member_id: int) -> discord.Member | None:
+        """Resolve a member, or None if they are not in the guild."""
+        member = guild.get_member(member_id)
+
+        if member is not None:
+            return member
+
+        key = (guild.id, member_id)
+        cached = self._members.get(key)
+
+        if cached is not None and cached[0] > time.monotonic():
+            self._members.move_to_end(key)
+            return cached[1]
+
+        try:
+            member = await guild.fetch_member(member_id)
+        except discord.HTTPException:
+            member = None
+
+        self._members[key] = (time.monotonic() + self._ttl, member)
+        self._members.move_to_end(key)
+
+        if len(self._members) > self._size:
+            self._members.popitem(last=False)
+
+        return member
@@ -0,0 +1,101 @@
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+import discord
+
+__all__ = ["NamelessHeadcount", "NamelessPopulation"]
+
+
+@dataclass
+class NamelessHeadcount:
+    """Humans and bots in one guild, or across all of them."""
+
+    humans: int = 0
+    bots: int = 0
+    # Members that were never cached, so not known to be either.
+    unknown: int = 0
+
+    @property
+    def total(self) -> int:
+        return self.humans + self.bots + self.unknown
+
+
+class NamelessPopulation:
+    """
+    Headcounts of every guild, kept current from gateway events.
+
+    Members are only ever counted once, when their guild shows up, so
+    reading a headcount never walks a member list. Members the client does
+    not cache are counted as unknown, since whether they are bots is not
+    known: the total stays exact, only the split between humans and bots
+    is partial.
+    """
+
+    def __init__(self) -> None:
+        self._guilds: dict[int, NamelessHeadcount] = {}
+        self.overall: NamelessHeadcount = NamelessHeadcount()
+
+    def load(self, guilds: Iterable[discord.Guild]):
+        """Count every member of these guilds from scratch."""
+        self._guilds.clear()
+        self.overall = NamelessHeadcount()
+
+        for guild in guilds:
+            self.add_guild(guild)
+
+    def get(self, guild_id: int) -> NamelessHeadcount:
+        """Get the headcount of a guild."""
+        return self._guilds.get(guild_id, NamelessHeadcount())
+
+    def add_guild(self, guild: discord.Guild):
+        self.remove_guild(guild.id)
+
+        headcount = self._guilds[guild.id] = NamelessHeadcount()
+
+        for member in guild.members:
+            self._count(headcount, member.bot, 1)
+
+        headcount.unknown = max((guild.member_count or 0) - len(guild.members), 0)
+        self.overall.unknown += headcount.unknown
+
+    def remove_guild(self, guild_id: int):
+        headcount = self._guilds.pop(guild_id, None)
+
+        if headcount is not None:
+            self.overall.humans -= headcount.humans
+            self.overall.bots -= headcount.bots
+            self.overall.unknown -= headcount.unknown
+
+    def add_member(self, member: discord.Member):
+        headcount = self._guilds.get(member.guild.id)
+
+        if headcount is None:
+            return
+
+        # Members not cached from here on are counted, and later uncounted, as unknown.
+        if member.guild.get_member(member.id) is None:
+            headcount.unknown += 1
+            self.overall.unknown += 1
+        else:
+            self._count(headcount, member.bot, 1)
+
+    def remove_member(self, guild_id: int, user: discord.User | discord.Member):
+        """Uncount someone who left. Only cached members come as `discord.Member`."""
+        headcount = self._guilds.get(guild_id)
+
+        if headcount is None:
+            return
+
+        if isinstance(user, discord.Member) or headcount.unknown == 0:
+            self._count(headcount, user.bot, -1)
+        else:
+            headcount.unknown -= 1
+            self.overall.unknown -= 1
+
+    def _count(self, headcount: NamelessHeadcount, is_bot: bool, delta: int):
+        if is_bot:
+            headcount.bots += delta
+            self.overall.bots += delta
+        else:
+            headcount.humans += delta
+            self.overall.humans += delta
@@ -0,0 +1,284 @@
+# pyright: reportPrivateUsage=false
+import asyncio
+import functools
+import json
+import logging
+import time
+from collections import deque
+from collections.abc import Callable
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+import aiohttp
+import discord
+import yarl
+from discord.backoff import ExponentialBackoff
+from discord.gateway import DiscordWebSocket, ReconnectWebSocket
+
+if TYPE_CHECKING:
+    # Only importable once discord.py is, at runtime it runs into its own import cycle.
+    from discord.types.guild import Guild as GuildPayload
+
+__all__ = ["NamelessGatewaySession"]
+
+# Guilds rebuilt at once after resuming, each one costs a handful of REST calls.
+_rebuild_concurrency = 5
+
+EventParser = Callable[[Any], None]
+
+
+class _SavedSession(NamedTuple):
+    session_id: str
+    sequence: int
+    resume_url: str
+    guild_ids: list[int]
+    saved_at: float
+
+
+class _GuildRebuild:
+    """
+    Guild state of a resumed session, fetched from REST in the background.
+
+    Events of a guild not rebuilt yet are held back, and that guild is
+    rebuilt next. They go through once it is, or are dropped if it can not
+    be, so listeners never see a guild event without its guild.
+    """
+
+    def __init__(self, client: discord.Client, guild_ids: list[int]) -> None:
+        self.client: discord.Client = client
+
+        self._waiting: deque[int] = deque(guild_ids)
+        self._missing: set[int] = set(guild_ids)
+        self._lost: set[int] = set()
+        self._held: dict[int, list[tuple[EventParser, Any]]] = {}
+
+        self._parsers: dict[str, EventParser] = {}
+        self._workers: list[asyncio.Task[None]] = []
+        self._running: int = 0
+        self._started: float = time.perf_counter()
+
+    def start(self):
+        parsers = self.client._connection.parsers
+        self._parsers = {**parsers}
+
+        # The gateway reads this very dict, so events go through the guard from now on.
+        for event, parse in self._parsers.items():
+            parsers[event] = functools.partial(self._guard, parse)
+
+        self._running = _rebuild_concurrency
+        self._workers = [asyncio.create_task(self._work()) for _ in range(_rebuild_concurrency)]
+
+    def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+
+        self.client._connection.parsers.update(self._parsers)
+
+    def _guard(self, parse: EventParser, data: Any):
+        guild_id = data.get("guild_id") if isinstance(data, dict) else None
+
+        if guild_id is None or int(guild_id) not in self._missing:
+            parse(data)
+            return
+
+        guild_id = int(guild_id)
+
+        if guild_id in self._lost:
+            return
+
+        if guild_id not in self._held:
+            self._held[guild_id] = []
+
+            if guild_id in self._waiting:
+                self._waiting.remove(guild_id)
+                self._waiting.appendleft(guild_id)
+
+        self._held[guild_id].append((parse, data))
+
+    async def _work(self):
+        try:
+            await self._rebuild_waiting()
+        finally:
+            self._running -= 1
+
+        if self._running == 0:
+            self._finish()
+
+    async def _rebuild_waiting(self):
+        while self._waiting:
+            guild_id = self._waiting.popleft()
+            data = await self._fetch(guild_id)
+            held = self._held.pop(guild_id, [])
+
+            if data is None:
+                self._lost.add(guild_id)
+                continue
+
+            guild = self.client._connection._add_guild_from_data(data)
+            self._missing.discard(guild_id)
+
+            for parse, event in held:
+                try:
+                    parse(event)
+                except Exception:
+                    logging.exception("Failed to replay an event held for guild %s.", guild_id)
+
+            self.client.dispatch("guild_available", guild)
+
+    def _finish(self):
+        # Events of guilds that could not be rebuilt keep being dropped.
+        if not self._lost:
+            self.client._connection.parsers.update(self._parsers)
+
+        logging.info(
+            "Rebuilt %d guild(s) in %.2fs, %d could not be.",
+            len(self.client.guilds),
+            time.perf_counter() - self._started,
+            len(self._lost),
+        )
+
+    async def _fetch(self, guild_id: int) -> "GuildPayload | None":
+        """Rebuild the gateway payload of a guild, or None if it is out of reach."""
+        client = self.client
+        assert client.user is not None
+
+        try:
+            data = await client.http.get_guild(guild_id, with_counts=True)
+            # Headcounts start from this, which only a gateway guild carries.
+            data["member_count"] = data.get("approximate_member_count", 0)
+            data["channels"] = await client.http.get_all_guild_channels(guild_id)
+            data["threads"] = (await client.http.get_active_threads(guild_id))["threads"]
+            data["members"] = [{**await client.http.get_member(guild_id, client.user.id)}]
+        except (discord.HTTPException, aiohttp.ClientError, OSError):
+            # Left or lost access while restarting, its events are dropped from here on.
+            logging.warning("Could not rebuild guild %s.", guild_id, exc_info=True)
+            return None
+
+        return data
+
+
+class NamelessGatewaySession:
+    """
+    Carry the gateway session over a restart, instead of identifying again.
+
+    A resumed session gets no READY nor GUILD_CREATE, so the client becomes
+    ready right away, and discord.py's own guild state is rebuilt from REST
+    in the background, without chunking members. Only an invalidated
+    session falls back to a regular identify, a dropped connection resumes
+    again.
+
+    This relies on discord.py internals, kept to this module.
+    """
+
+    def __init__(self, path: Path, max_age: float) -> None:
+        self.path: Path = path
+        self.max_age: float = max_age
+
+    def save(self, client: discord.Client) -> bool:
+        """Save the current session, right before the process is replaced."""
+        ws = client.ws
+
+        if self.max_age <= 0 or ws is None or ws.session_id is None or ws.sequence is None:
+            return False
+
+        saved = _SavedSession(
+            ws.session_id,
+            ws.sequence,
+            str(ws.gateway),
+            [guild.id for guild in client.guilds],
+            time.time(),
+        )
+
+        self.path.write_text(json.dumps(saved._asdict()), encoding="utf-8")
+        return True
+
+    async def resume(self, client: discord.Client):
+        """Run a saved session, if any, until it ends. Identifying is up to the caller."""
+        saved = self._load()
+
+        if saved is None:
+            return
+
+        if isinstance(client, discord.AutoShardedClient):
+            # Saving only covers the single gateway socket of an unsharded client.
+            logging.info("Not resuming a saved gateway session over shards.")
+            return
+
+        gateway = yarl.URL(saved.resume_url)
+        session_id: str | None = saved.session_id
+        sequence: int | None = saved.sequence
+        rebuild: _GuildRebuild | None = None
+        backoff = ExponentialBackoff()
+
+        try:
+            while not client.is_closed():
+                try:
+                    client.ws = await asyncio.wait_for(
+                        DiscordWebSocket.from_client(
+                            client,
+                            gateway=gateway,
+                            session=session_id,
+                            sequence=sequence,
+                            resume=True,
+                        ),
+                        timeout=60.0,
+                    )
+
+                    if rebuild is None:
+                        logging.info("Resumed gateway session, rebuilding guild state.")
+                        rebuild = _GuildRebuild(client, saved.guild_ids)
+                        rebuild.start()
+
+                        client._handle_ready()
+                        client.dispatch("ready")
+
+                    while True:
+                        await client.ws.poll_event()
+                except ReconnectWebSocket as ex:
+                    if not ex.resume:
+                        logging.warning("Gateway session was invalidated, identifying again.")
+                        return
+                except discord.ConnectionClosed as ex:
+                    # Anything but a clean close is fatal, the regular connect reports it.
+                    if ex.code != 1000:
+                        logging.warning("Gateway closed the session with %d.", ex.code)
+                        return
+
+                    await asyncio.sleep(backoff.delay())
+                except (
+                    OSError,
+                    discord.HTTPException,
+                    discord.GatewayNotFound,
+                    aiohttp.ClientError,
+                    asyncio.TimeoutError,
+                ):
+                    logging.warning("Lost the gateway connection, resuming again.", exc_info=True)
+                    await asyncio.sleep(backoff.delay())
+
+                if client.ws is not None and client.ws.session_id is not None:
+                    gateway = client.ws.gateway
+                    session_id = client.ws.session_id
+                    sequence = client.ws.sequence
+        finally:
+            # A fresh identify brings the whole guild state along.
+            if rebuild is not None:
+                rebuild.stop()
+
+    def _load(self) -> _SavedSession | None:
+        """Take the saved session, if it is recent enough to still be resumed."""
+        if not self.path.exists():
+            return None
+
+        try:
+            saved = _SavedSession(**json.loads(self.path.read_text(encoding="utf-8")))
+        except (ValueError, TypeError):
+            logging.warning("Ignoring unreadable gateway session at %s.", self.path)
+            return None
+        finally:
+            self.path.unlink(missing_ok=True)
+
+        if time.time() - saved.saved_at > self.max_age:
+            logging.info("Saved gateway session is too old to resume.")
+            return None
+
+        return saved
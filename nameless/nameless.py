@@ -1,25 +1,53 @@
+import asyncio
+import contextlib
+import hashlib
+import json
 import logging
 import os
 import re
+import sys
+import tempfile
+import time
+from collections import Counter
+from collections.abc import Iterator
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Callable, override
+from typing import Any, Callable, override
 
 import discord
 from discord import ActivityType, Permissions
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 from nameless.config import nameless_config
-from nameless.custom import NamelessPrisma
+from nameless.custom import (
+    CrossOverMessageStore,
+    CrossOverMetrics,
+    CrossOverOutbox,
+    CrossOverRelayBus,
+    CrossOverResolver,
+    CrossOverRetention,
+    CrossOverRoutingTable,
+    CrossOverScheduler,
+    NamelessGatewaySession,
+    NamelessMemberCache,
+    NamelessPopulation,
+    NamelessPrisma,
+    get_rss,
+)
 
-__all__ = ["Nameless"]
+__all__ = ["Nameless", "NamelessSharded"]
 
 
 class Nameless(commands.Bot):
     """Customized Discord instance, or so called, nameless* bot."""
 
     def __init__(
-        self, prefix: str | list[str] | Callable[..., list[str]], *args: object, **kwargs: object
+        self,
+        prefix: str | list[str] | Callable[..., list[str]],
+        *args: object,
+        worker_id: int | None = None,
+        worker_count: int = 1,
+        **kwargs: object,
     ):
         # Downcasting because duck typed is a b*tch
         _description: str = nameless_config["nameless"]["description"]
@@ -28,31 +56,189 @@ class Nameless(commands.Bot):
         _intents.message_content = True
         _intents.members = True
 
-        super().__init__(prefix, *args, intents=_intents, description=_description, **kwargs)
+        # The low-memory profile fetches members when needed, rather than holding all from startup.
+        self.low_memory: bool = nameless_config["nameless"]["low_memory"]["enabled"]
+        _max_messages: int = (
+            nameless_config["nameless"]["low_memory"]["max_messages"]
+            if self.low_memory
+            else nameless_config["nameless"]["max_messages"]
+        )
+
+        super().__init__(
+            prefix,
+            *args,
+            intents=_intents,
+            description=_description,
+            chunk_guilds_at_startup=not self.low_memory,
+            member_cache_flags=(
+                discord.MemberCacheFlags.none()
+                if self.low_memory
+                else discord.MemberCacheFlags.from_intents(_intents)
+            ),
+            max_messages=_max_messages or None,
+            max_ratelimit_timeout=nameless_config["crossover"]["max_ratelimit_wait"],
+            **kwargs,
+        )
+
+        self.crossover_messages: CrossOverMessageStore = CrossOverMessageStore(
+            nameless_config["crossover"]["mapping_flush_size"],
+            nameless_config["crossover"]["mapping_flush_interval"],
+            nameless_config["crossover"]["mapping_cache_size"],
+        )
+        self.crossover_metrics: CrossOverMetrics = CrossOverMetrics()
+        self.crossover_outbox: CrossOverOutbox = CrossOverOutbox(
+            nameless_config["crossover"]["mapping_flush_interval"],
+            nameless_config["crossover"]["outbox_replay_batch_size"],
+            nameless_config["crossover"]["outbox_max_age_hours"] * 3600,
+            worker_id or 0,
+            worker_count,
+        )
+        self.crossover_resolver: CrossOverResolver = CrossOverResolver(
+            self,
+            nameless_config["crossover"]["resolve_cache_ttl"],
+            nameless_config["crossover"]["resolve_negative_ttl"],
+            nameless_config["crossover"]["resolve_cache_size"],
+        )
+        self.crossover_retention: CrossOverRetention = CrossOverRetention(
+            nameless_config["crossover"]["retention"]["max_age_days"],
+            nameless_config["crossover"]["retention"]["max_rows_per_member"],
+            nameless_config["crossover"]["retention"]["batch_size"],
+            nameless_config["crossover"]["retention"]["compaction"],
+        )
+        self.crossover_routes: CrossOverRoutingTable = CrossOverRoutingTable()
+        self.crossover_scheduler: CrossOverScheduler = CrossOverScheduler(
+            nameless_config["crossover"]["channel_rate"],
+            nameless_config["crossover"]["channel_per"],
+        )
+
+        self._outbox_replay: asyncio.Task[None] | None = None
+
+        self._startup_timings: list[tuple[str, float]] = []
+        # Seconds each extension took to load on startup, None if it failed.
+        self.extension_timings: dict[str, float | None] = {}
+
+        # Set when started by the launcher, worker 0 runs the work only one process should do.
+        self.worker_id: int | None = worker_id
+        self.crossover_bus: CrossOverRelayBus = CrossOverRelayBus(
+            Path(os.getenv("NAMELESS_BUS_DIR", tempfile.gettempdir())),
+            worker_id,
+            worker_count,
+            self.shard_count or 1,
+            nameless_config["crossover"]["bus_max_pending"],
+            nameless_config["crossover"]["bus_send_timeout"],
+        )
+        self._shard_report: tasks.Loop[Any] | None = None
+
+        self.population: NamelessPopulation = NamelessPopulation()
+        self.member_cache: NamelessMemberCache = NamelessMemberCache(
+            nameless_config["nameless"]["low_memory"]["member_cache_ttl"],
+            nameless_config["nameless"]["low_memory"]["member_cache_size"],
+        )
+
+        self._command_hash_path: Path = (
+            Path(__file__).parent.parent.absolute() / "nameless.commands.json"
+        )
+        self.gateway_session: NamelessGatewaySession = NamelessGatewaySession(
+            Path(__file__).parent.parent.absolute() / "nameless.session.json",
+            nameless_config["nameless"]["resume_max_age"],
+        )
 
     @override
     async def setup_hook(self):
+        started = time.perf_counter()
+
         logging.info("Connecting to database.")
-        await NamelessPrisma.init()
+        with self._timed("Database"):
+            await NamelessPrisma.init(nameless_config["crossover"]["retention"]["compaction"])
+
+        logging.info("Loading crossover routes.")
+        with self._timed("Crossover routes"):
+            await self.crossover_routes.load()
+
+        if self.is_primary:
+            logging.info("Starting crossover retention.")
+            self.crossover_retention.start(
+                nameless_config["crossover"]["retention"]["interval_minutes"]
+            )
 
         logging.info("Registering commands.")
-        await self._register_commands()
+        with self._timed("Commands"):
+            await self._register_commands()
+
+        if self.crossover_bus.enabled:
+            logging.info("Starting crossover relay bus.")
+            with self._timed("Crossover relay bus"):
+                await self.crossover_bus.start()
+
+        # Every worker replays what it recorded itself, so a worker restarted alone
+        # neither waits for worker 0 nor repeats the work of live ones.
+        logging.info("Replaying crossover outbox once connected.")
+        self._outbox_replay = asyncio.create_task(self._replay_crossover_outbox())
+
+        if self.is_primary:
+            logging.info("Syncing commands.")
+            with self._timed("Command sync"):
+                await self._sync_commands()
 
-        logging.info("Syncing commands.")
-        await self.tree.sync()
         logging.warning("Text-based Commands should be available now.")
-        logging.warning("Application Commands should be available in one hour.")
+        self._log_startup_timings(time.perf_counter() - started)
 
     async def on_ready(self):
         logging.info("Setting presence.")
         await self._change_presence()
 
+        logging.info("Counting members.")
+        self.population.load(self.guilds)
+
+        logging.info(
+            "Using %.1f MiB of memory under the %s profile.",
+            get_rss() / 1024**2,
+            "low-memory" if self.low_memory else "default",
+        )
+
         assert self.user is not None
         logging.info("Logged in as %s (ID: %s)", str(self.user), self.user.id)
 
+        report_interval: float = nameless_config["nameless"]["sharding"]["report_interval"]
+
+        # The first report goes out right away, as a summary of this worker's start.
+        if self._shard_report is None and report_interval > 0:
+            self._shard_report = tasks.loop(seconds=report_interval)(self._log_shard_report)
+            self._shard_report.start()
+
         logging.info("nameless* is now operational!")
         nameless_config["nameless"]["start_time"] = datetime.now(timezone.utc)
 
+    async def on_guild_join(self, guild: discord.Guild):
+        self.population.add_guild(guild)
+
+    async def on_guild_available(self, guild: discord.Guild):
+        # Guilds of a resumed session show up only after ready.
+        self.population.add_guild(guild)
+
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.population.remove_guild(guild.id)
+
+    async def on_member_join(self, member: discord.Member):
+        self.population.add_member(member)
+
+    async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent):
+        self.population.remove_member(payload.guild_id, payload.user)
+
+    @property
+    def is_primary(self) -> bool:
+        """Whether this process runs the work shared by all workers."""
+        return self.worker_id in (None, 0)
+
+    def shard_latencies(self) -> list[tuple[int, float]]:
+        """Latency of each shard this process owns."""
+        return [(self.shard_id or 0, self.latency)]
+
+    def shard_report(self) -> list[tuple[int, float, int]]:
+        """Latency and guild count of each shard this process owns."""
+        guilds = Counter(guild.shard_id for guild in self.guilds)
+        return [(x, latency, guilds[x]) for x, latency in self.shard_latencies()]
+
     def start_bot(self, *, is_debug: bool = False):
         """Starts the bot."""
         logging.info(f"This bot will now start in {'debug' if is_debug else 'production'} mode.")
@@ -61,10 +247,77 @@ class Nameless(commands.Bot):
     @override
     async def close(self):
         logging.warning("Shutting down...")
+        await self.drain()
         await NamelessPrisma.dispose()
         await super().close()
         exit(0)
 
+    @override
+    async def connect(self, *, reconnect: bool = True):
+        await self.gateway_session.resume(self)
+        await super().connect(reconnect=reconnect)
+
+    async def restart(self):
+        """Drain like on shutdown, then replace this process with a fresh one."""
+        logging.warning("Restarting...")
+
+        # Saved before draining unloads the cogs, so events from here on are replayed
+        # to the new process. The socket is left to die with this process, since a
+        # clean close would end the session.
+        if self.gateway_session.save(self):
+            logging.info("Saved gateway session, the new process will resume it.")
+
+        await self.drain()
+        await NamelessPrisma.dispose()
+        os.execl(sys.executable, sys.executable, *sys.argv)
+
+    async def drain(self):
+        """
+        Stop taking crossover work, then finish what is in flight.
+
+        Unloading the cogs and the queued relays share `crossover.drain_timeout`
+        seconds, whatever is left stays in the outbox for the next run. Buffered
+        writes always go out.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + nameless_config["crossover"]["drain_timeout"]
+
+        self.crossover_retention.stop()
+
+        if self._shard_report is not None:
+            self._shard_report.cancel()
+
+        if self._outbox_replay is not None:
+            self._outbox_replay.cancel()
+
+        # Unloaded first, so nothing takes new work and the cogs hand over what they hold.
+        try:
+            async with asyncio.timeout_at(deadline):
+                for extension in tuple(self.extensions):
+                    try:
+                        await self.unload_extension(extension)
+                    except Exception:
+                        logging.exception("Failed to unload %s while draining.", extension)
+        except TimeoutError:
+            logging.warning("Unloading extensions ran past the drain deadline, moving on.")
+
+        sent, dropped = await self.crossover_scheduler.drain(max(deadline - loop.time(), 0))
+        await self.crossover_bus.close()
+        mappings = await self.crossover_messages.flush()
+        outbox = await self.crossover_outbox.flush()
+
+        logging.info(
+            "Drained %d crossover relay(s), flushed %d mapping(s) and %d outbox change(s).",
+            sent,
+            mappings,
+            outbox,
+        )
+
+        if dropped:
+            logging.warning(
+                "Dropped %d crossover relay(s) past the deadline, left for the next run.", dropped
+            )
+
     @staticmethod
     def get_needed_permissions() -> Permissions:
         """Get minimum permissions needed for bare functionalities."""
@@ -83,6 +336,51 @@ class Nameless(commands.Bot):
 
         return perms
 
+    async def _log_shard_report(self):
+        for shard_id, latency, guilds in self.shard_report():
+            logging.info("Shard %d: %.0fms latency, %d guild(s).", shard_id, latency * 1000, guilds)
+
+    async def _replay_crossover_outbox(self):
+        """Carry out crossover work an earlier run did not get to."""
+        await self.wait_until_ready()
+        await self.crossover_outbox.replay()
+
+    def clear_command_hash(self):
+        """Forget the last synced command tree, so the next start syncs again."""
+        self._command_hash_path.unlink(missing_ok=True)
+
+    async def _sync_commands(self):
+        """Sync application commands, unless they are the same as last synced."""
+        # Sorted, since concurrently loaded extensions add their commands in no set order.
+        payload = sorted(
+            (command.to_dict(self.tree) for command in self.tree.get_commands()),
+            key=lambda x: (x["name"], x.get("type", 1)),
+        )
+        command_hash = hashlib.sha256(
+            json.dumps([self.application_id, payload], sort_keys=True).encode()
+        ).hexdigest()
+
+        try:
+            last_sync = json.loads(self._command_hash_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            last_sync = {}
+
+        if last_sync.get("hash") == command_hash:
+            logging.info(
+                "Application commands are unchanged, skipped syncing them (took %.2fs last time).",
+                last_sync["duration"],
+            )
+            return
+
+        started = time.perf_counter()
+        await self.tree.sync()
+        duration = time.perf_counter() - started
+
+        self._command_hash_path.write_text(
+            json.dumps({"hash": command_hash, "duration": duration}), encoding="utf-8"
+        )
+        logging.warning("Application Commands should be available in one hour.")
+
     async def _change_presence(self):
         """Set up nameless status."""
         await self.change_presence(
@@ -91,7 +389,13 @@ class Nameless(commands.Bot):
         )
 
     async def _register_commands(self):
-        """Registers all available commands."""
+        """
+        Registers all available commands, timing each one.
+
+        Imports still run one after another on the loop, only setups overlap
+        where they wait. Only a failure in one of `nameless.extensions.required`
+        stops the startup, the others are logged and left unloaded.
+        """
 
         # We get ones that end in .py, in `command` directory.
         # And ignore ones that starts with _ (underscore)
@@ -99,11 +403,63 @@ class Nameless(commands.Bot):
         py_file_re = re.compile(r"^(?!_.*)(\w.*).py")
         available_files = [*filter(py_file_re.match, os.listdir(current_path / "command"))]
 
-        for file in available_files:
-            module_name = file.replace(".py", "")
-            module_name = f"nameless.command.{module_name}"
+        module_names = [f"nameless.command.{x.replace('.py', '')}" for x in available_files]
+        required: list[str] = nameless_config["nameless"]["extensions"]["required"]
+
+        results = await asyncio.gather(
+            *[self._load_command(x) for x in module_names], return_exceptions=True
+        )
+
+        for module_name, result in zip(module_names, results, strict=True):
+            if not isinstance(result, BaseException):
+                continue
+
+            if module_name.removeprefix("nameless.command.") in required:
+                raise result
+
+            logging.error("Skipped loading %s.", module_name, exc_info=result)
+
+    async def _load_command(self, module_name: str):
+        """Load one extension, timing its import and setup together."""
+        self.extension_timings[module_name] = None
+        started = time.perf_counter()
+
+        await self.load_extension(module_name)
+
+        self.extension_timings[module_name] = time.perf_counter() - started
 
-            try:
-                await self.load_extension(module_name)
-            except commands.ExtensionFailed as ex:
-                raise ex
+    @contextlib.contextmanager
+    def _timed(self, step: str) -> Iterator[None]:
+        started = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self._startup_timings.append((step, time.perf_counter() - started))
+
+    def _log_startup_timings(self, total: float):
+        logging.info("Started up in %.2fs:", total)
+
+        for step, duration in self._startup_timings:
+            logging.info("  %s: %.2fs", step, duration)
+
+        logging.info("  Commands, by extension:")
+
+        for module_name, timing in self.extension_timings.items():
+            if timing is None:
+                logging.info("    %s: failed", module_name)
+            else:
+                logging.info("    %s: %.2fs", module_name, timing)
+
+
+# BotBase.__init__ is reached through Nameless, as commands.Bot and AutoShardedBot define none.
+class NamelessSharded(Nameless, commands.AutoShardedBot):  # pyright: ignore[reportUnsafeMultipleInheritance]
+    """
+    Nameless over several gateway shards, in one process.
+
+    `launcher.py` starts several of these, each owning a range of the shards.
+    """
+
+    @override
+    def shard_latencies(self) -> list[tuple[int, float]]:
+        return self.latencies
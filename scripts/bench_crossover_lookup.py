@@ -0,0 +1,149 @@
+"""
+Measure crossover lookup latency against table size, with and without the schema indexes.
+
+Both crossover tables are filled to each requested size in a scratch SQLite
+file, using the same layout Prisma creates for `nameless/prisma/schema.prisma`.
+Every hot-path lookup in `nameless/command/crossover.py` is then timed,
+once on the bare tables and once after creating the indexes.
+
+Usage:
+    python scripts/bench_crossover_lookup.py [--sizes 10000,100000,1000000,10000000]
+"""
+
+import argparse
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+_tables: list[str] = [
+    """
+    CREATE TABLE "CrossChatRoomMember" (
+        "Id" TEXT NOT NULL PRIMARY KEY,
+        "RoomId" TEXT NOT NULL,
+        "GuildId" BIGINT NOT NULL,
+        "ChannelId" BIGINT NOT NULL,
+        "Coalesce" BOOLEAN NOT NULL DEFAULT false
+    )
+    """,
+    """
+    CREATE TABLE "CrossChatMessage" (
+        "Id" TEXT NOT NULL PRIMARY KEY,
+        "MemberId" TEXT,
+        "ConnectionId" TEXT,
+        "OriginMessageId" BIGINT NOT NULL,
+        "ClonedMessageId" BIGINT NOT NULL,
+        "EmbedIndex" INTEGER,
+        "CreatedAt" DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+]
+
+_indexes: list[str] = [
+    'CREATE UNIQUE INDEX "CrossChatRoomMember_RoomId_GuildId_ChannelId_key" '
+    'ON "CrossChatRoomMember"("RoomId", "GuildId", "ChannelId")',
+    'CREATE INDEX "CrossChatRoomMember_GuildId_ChannelId_idx" '
+    'ON "CrossChatRoomMember"("GuildId", "ChannelId")',
+    'CREATE INDEX "CrossChatMessage_OriginMessageId_idx" ON "CrossChatMessage"("OriginMessageId")',
+    'CREATE INDEX "CrossChatMessage_MemberId_CreatedAt_idx" '
+    'ON "CrossChatMessage"("MemberId", "CreatedAt")',
+]
+
+# Each lookup, with how to build its parameters from a random row number.
+_lookups: dict[str, tuple[str, Callable[[int], tuple[object, ...]]]] = {
+    "member by channel": (
+        'SELECT * FROM "CrossChatRoomMember" WHERE "GuildId" = ? AND "ChannelId" = ?',
+        lambda key: (key, key),
+    ),
+    "member by room": (
+        'SELECT * FROM "CrossChatRoomMember" '
+        'WHERE "RoomId" = ? AND "GuildId" = ? AND "ChannelId" = ?',
+        lambda key: (f"room{key % 100}", key, key),
+    ),
+    "message by origin": (
+        'SELECT m.*, r."GuildId", r."ChannelId" FROM "CrossChatMessage" m '
+        'LEFT JOIN "CrossChatRoomMember" r ON r."Id" = m."MemberId" '
+        'WHERE m."OriginMessageId" = ?',
+        lambda key: (key,),
+    ),
+    "oldest of member": (
+        'SELECT "Id" FROM "CrossChatMessage" WHERE "MemberId" = ? '
+        'ORDER BY "CreatedAt" ASC LIMIT 500',
+        lambda key: (f"r{key}",),
+    ),
+}
+
+
+def fill(db: sqlite3.Connection, size: int):
+    """Fill both tables with `size` rows each."""
+    db.executemany(
+        'INSERT INTO "CrossChatRoomMember" VALUES (?, ?, ?, ?, false)',
+        ((f"r{i}", f"room{i % 100}", i, i) for i in range(size)),
+    )
+    db.executemany(
+        'INSERT INTO "CrossChatMessage" ("Id", "MemberId", "OriginMessageId", "ClonedMessageId") '
+        "VALUES (?, ?, ?, ?)",
+        ((f"m{i}", f"r{i}", i, size + i) for i in range(size)),
+    )
+    db.commit()
+
+
+def time_lookups(db: sqlite3.Connection, size: int, rounds: int) -> dict[str, float]:
+    """Median latency of each lookup, in milliseconds."""
+    result: dict[str, float] = {}
+
+    for name, (query, make_params) in _lookups.items():
+        samples: list[float] = []
+
+        for _ in range(rounds):
+            params = make_params(random.randrange(size))
+
+            start = time.perf_counter()
+            db.execute(query, params).fetchall()
+            samples.append((time.perf_counter() - start) * 1000)
+
+        result[name] = statistics.median(samples)
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure crossover lookup latency against table size."
+    )
+    parser.add_argument("--sizes", default="10000,100000,1000000,10000000")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    sizes = [int(x) for x in args.sizes.split(",")]
+
+    print(f"{'rows':>10} | {'lookup':<22} | {'no index (ms)':>14} | {'indexed (ms)':>13}")
+    print("-" * 70)
+
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as scratch:
+            db = sqlite3.connect(Path(scratch) / "bench.sqlite")
+
+            for table in _tables:
+                db.execute(table)
+
+            fill(db, size)
+            before = time_lookups(db, size, args.rounds)
+
+            for index in _indexes:
+                db.execute(index)
+
+            db.commit()
+            after = time_lookups(db, size, args.rounds)
+
+            db.close()
+
+        for name in _lookups:
+            print(f"{size:>10} | {name:<22} | {before[name]:>14.3f} | {after[name]:>13.3f}")
+
+
+if __name__ == "__main__":
+    main()
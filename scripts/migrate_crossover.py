@@ -0,0 +1,66 @@
+"""
+Prepare an existing nameless.sqlite for the crossover schema constraints.
+
+`prisma db push` refuses to add the unique constraint on CrossChatConnection
+while duplicated links exist. This script folds every duplicate into the
+oldest link of its group, moving its relayed messages along, so the push
+can go through afterwards.
+
+Usage:
+    python scripts/migrate_crossover.py [path/to/nameless.sqlite]
+    prisma db push --schema nameless/prisma/schema.prisma
+"""
+
+import sqlite3
+import sys
+from pathlib import Path
+
+_default_db_path: Path = Path(__file__).parent.parent.absolute() / "nameless.sqlite"
+
+
+def dedupe_connections(db: sqlite3.Connection) -> int:
+    """Fold duplicated connections into one, returning how many were removed."""
+    duplicates = db.execute(
+        """
+        SELECT c.Id, k.Id FROM CrossChatConnection c
+        JOIN (
+            SELECT MIN(rowid) AS KeptRowId, SourceGuildId, SourceChannelId,
+                   TargetGuildId, TargetChannelId
+            FROM CrossChatConnection
+            GROUP BY SourceGuildId, SourceChannelId, TargetGuildId, TargetChannelId
+            HAVING COUNT(*) > 1
+        ) g ON c.SourceGuildId IS g.SourceGuildId
+           AND c.SourceChannelId = g.SourceChannelId
+           AND c.TargetGuildId = g.TargetGuildId
+           AND c.TargetChannelId = g.TargetChannelId
+           AND c.rowid <> g.KeptRowId
+        JOIN CrossChatConnection k ON k.rowid = g.KeptRowId
+        """
+    ).fetchall()
+
+    for duplicate_id, kept_id in duplicates:
+        db.execute(
+            "UPDATE CrossChatMessage SET ConnectionId = ? WHERE ConnectionId = ?",
+            (kept_id, duplicate_id),
+        )
+        db.execute("DELETE FROM CrossChatConnection WHERE Id = ?", (duplicate_id,))
+
+    return len(duplicates)
+
+
+def main():
+    db_path = Path(sys.argv[1]) if len(sys.argv) > 1 else _default_db_path
+
+    if not db_path.exists():
+        print(f"{db_path} does not exist, nothing to migrate.")
+        return
+
+    with sqlite3.connect(db_path) as db:
+        removed = dedupe_connections(db)
+
+    print(f"Removed {removed} duplicated crossover connection(s) from {db_path}.")
+    print("Now run: prisma db push --schema nameless/prisma/schema.prisma")
+
+
+if __name__ == "__main__":
+    main()